@@ -507,7 +507,9 @@ class MainWindow(Ui_FormMainMenu):
                 evaluator = MCTSEvaluator(
                     args=self.pit_args,
                     model=self.pit_chosen_eval_model[1] if self.pit_chosen_eval_model[0] != 'RawMCTS' else None,
-                    max_search_time=self.pit_eval_max_runtime if self.pit_eval_max_runtime else None
+                    max_search_time=self.pit_eval_max_runtime if self.pit_eval_max_runtime else None,
+                    leaves_per_batch=self.pit_args.get('mctsLeavesPerTree', 1),
+                    num_threads=self.pit_args.get('mctsEvaluatorThreads', 1)
                 )
 
             # wrap all players with custom gui wrapper class
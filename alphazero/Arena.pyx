@@ -1,9 +1,10 @@
 # cython: language_level=3
 from alphazero.Game import GameState
 from alphazero.GenericPlayers import BasePlayer
+from alphazero.InferenceServer import InferenceServer
 from alphazero.SelfPlayAgent import SelfPlayAgent
 from alphazero.pytorch_classification.utils import Bar, AverageMeter
-from alphazero.utils import dotdict, get_game_results
+from alphazero.utils import dotdict, get_game_results, new_search_stats
 
 from typing import Callable, List, Tuple, Optional
 from enum import Enum
@@ -21,11 +22,29 @@ class _PlayerStats:
         self.index = index
         self.wins = 0
         self.winrate = 0
+        self.moves = 0
+        self.sims = 0
+        self.saved_sims = 0
+        self.time = 0
 
     def reset_wins(self):
         self.wins = 0
         self.winrate = 0
 
+    def reset_search(self):
+        self.moves = 0
+        self.sims = 0
+        self.saved_sims = 0
+        self.time = 0
+
+    def add_move(self, search_stats: Optional[dict]):
+        if search_stats is None:
+            return
+        self.moves += 1
+        self.sims += search_stats['sims']
+        self.saved_sims += search_stats['saved_sims']
+        self.time += search_stats.get('time', 0)
+
     def add_win(self):
         self.wins += 1
 
@@ -98,6 +117,8 @@ class Arena:
         self.total_time = 0
         self.eta = 0
         self.game_state = None
+        # the final states of the games played by play_games if result_states is set
+        self.game_states = []
         self.draws = 0
         self._agents = []
         self.stop_event = mp.Event()
@@ -119,7 +140,9 @@ class Arena:
 
     def __reset_stats(self):
         self.draws = 0
+        self.game_states = []
         [s.reset_wins() for s in self.__player_stats]
+        [s.reset_search() for s in self.__player_stats]
 
     def __update_winrates(self):
         num_games = sum([s.wins for s in self.__player_stats]) + (
@@ -135,6 +158,22 @@ class Arena:
     def winrates(self) -> List[float]:
         return [s.winrate for s in self.__player_stats]
 
+    def saved_sims(self) -> List[float]:
+        """Average number of simulations per move that each player saved by stopping its search early."""
+        return [s.saved_sims / s.moves if s.moves else 0 for s in self.__player_stats]
+
+    def sims_per_second(self) -> List[float]:
+        """Number of simulations that each player searched per second of its search time."""
+        return [s.sims / s.time if s.time else 0 for s in self.__player_stats]
+
+    def __search_suffix(self) -> str:
+        suffix = ''
+        if self.args.get('mctsEarlyStop'):
+            suffix += f' | Saved Sims: {[round(s, 1) for s in self.saved_sims()]}'
+        if any(s.time for s in self.__player_stats):
+            suffix += f' | Sims/s: {[round(s) for s in self.sims_per_second()]}'
+        return suffix
+
     @_set_state(ArenaState.SINGLE_GAME)
     def play_game(self, verbose=False, _player_to_index: List[int] = None) -> Tuple[GameState, np.ndarray]:
         """
@@ -158,9 +197,11 @@ class Arena:
             while self.pause_event.is_set():
                 time.sleep(.1)
 
-            action = self.players[player_to_index[self.game_state.player]](self.game_state)
+            player = player_to_index[self.game_state.player]
+            action = self.players[player](self.game_state)
             if self.stop_event.is_set() or not isinstance(action, int):
                 break
+            self.__player_stats[player].add_move(self.players[player].search_stats())
 
             # valids = state.valid_moves()
             # assert valids[action] > 0, ' '.join(map(str, [action, index, state.player, turns, valids]))
@@ -228,6 +269,7 @@ class Arena:
             result_queue = mp.Queue()
             completed = mp.Value('i', 0)
             games_played = mp.Value('i', 0)
+            search_stats = new_search_stats(self.game_cls.num_players())
 
             # self.args.expertValueWeight.current = self.args.expertValueWeight.start
             # if self.args.workers >= mp.cpu_count():
@@ -254,33 +296,27 @@ class Arena:
                     SelfPlayAgent(i, self.game_cls, ready_queue, batch_ready[i],
                                   input_tensors, policy_tensors[i], value_tensors[i], batch_queues[i],
                                   result_queue, completed, games_played, self.stop_event, self.pause_event, self.args,
-                                  _is_arena=True))
+                                  _is_arena=True, search_stats=search_stats))
                 self._agents[i].daemon = True
                 self._agents[i].start()
 
             sample_time = AverageMeter()
             end = time.time()
+            # the batch of an agent holds the rows of each player, games whose search
+            # is done don't add rows to it
+            server = InferenceServer(
+                ready_queue, policy_tensors, value_tensors, batch_ready,
+                self.args.get('inferenceBatchSize'), self.args.get('inferenceMaxWait', 0) / 1000
+            )
+            models = [player.process for player in self.players]
 
             n = 0
             while completed.value != self.args.workers:
-                try:
-                    id = ready_queue.get(timeout=1)
-
-                    policy = []
-                    value = []
-                    data = batch_queues[id].get()
-                    for player in range(len(self.players)):
-                        batch = data[player]
-                        if not isinstance(batch, list):
-                            p, v = self.players[player].process(batch)
-                            policy.append(p.to(policy_tensors[id].device))
-                            value.append(v.to(value_tensors[id].device))
-
-                    policy_tensors[id].copy_(torch.cat(policy))
-                    value_tensors[id].copy_(torch.cat(value))
-                    batch_ready[id].set()
-                except Empty:
-                    pass
+                times = server.process(models, lambda id: batch_queues[id].get())
+                if any(times):
+                    with search_stats.time.get_lock():
+                        for player, process_time in enumerate(times):
+                            search_stats.time[player] += process_time
 
                 size = games_played.value
                 if size > n:
@@ -291,18 +327,24 @@ class Arena:
                 wins, draws, _ = get_game_results(
                     result_queue,
                     self.game_cls,
-                    _get_index=lambda p, i: self._agents[i].player_to_index[p]
+                    _get_index=lambda p, i: self._agents[i].player_to_index[p],
+                    states=self.game_states
                 )
                 for i, w in enumerate(wins):
                     self.__player_stats[i].wins += w
                 self.draws += draws
                 self.__update_winrates()
+                for i, stats in enumerate(self.__player_stats):
+                    stats.moves = search_stats.moves[i]
+                    stats.sims = search_stats.sims[i]
+                    stats.saved_sims = search_stats.saved_sims[i]
+                    stats.time = search_stats.time[i]
 
                 bar.suffix = '({eps}/{maxeps}) Winrates: {wr} | Eps Time: {et:.3f}s | Total: {total:} | ETA: {eta:}' \
                     .format(
                         eps=size, maxeps=num, et=sample_time.avg, total=bar.elapsed_td, eta=bar.eta_td,
                         wr=[round(w, 3) for w in self.winrates()]
-                    )
+                    ) + self.__search_suffix()
                 bar.goto(size)
 
                 self.games_played = size
@@ -344,9 +386,11 @@ class Arena:
                 get_player_order()
 
                 # Play a single game with the current player order
-                _, winstate = self.play_game(verbose, players)
+                state, winstate = self.play_game(verbose, players)
                 if self.stop_event.is_set():
                     break
+                if self.args.get('result_states'):
+                    self.game_states.append(state)
 
                 # Bookkeeping + plot progress
                 for player, is_win in enumerate(winstate):
@@ -363,7 +407,7 @@ class Arena:
                     .format(
                         eps=eps, maxeps=num, et=eps_time.avg, total=bar.elapsed_td, eta=bar.eta_td,
                         wr=[round(w, 3) for w in self.winrates()]
-                    )
+                    ) + self.__search_suffix()
                 bar.next()
                 self.games_played = eps
                 self.eps_time = eps_time.avg
@@ -3,7 +3,11 @@ from numpy import get_include
 pyxinstall(setup_args={'include_dirs': get_include()})
 
 from alphazero.SelfPlayAgent import SelfPlayAgent
-from alphazero.utils import get_iter_file, dotdict, get_game_results, default_temp_scaling
+from alphazero.InferenceServer import InferenceServer
+from alphazero.SampleBuffer import SampleBuffer
+from alphazero.MCTS import PROFILE_STATS
+from alphazero.utils import get_iter_file, dotdict, get_game_results, default_temp_scaling, new_search_stats, \
+    reset_search_stats, RESIGN_CALIBRATION_BINS
 from alphazero.Arena import Arena
 from alphazero.GenericPlayers import RawMCTSPlayer, NNPlayer, MCTSPlayer
 from alphazero.pytorch_classification.utils import Bar, AverageMeter
@@ -26,9 +30,15 @@ DEFAULT_ARGS = dotdict({
     'run_name': 'boardgame',
     'cuda': torch.cuda.is_available(),
     'workers': mp.cpu_count(),
+    'inferenceBatchSize': None,  # Rows of agent batches that are gathered into one NN evaluation, None for all that are ready
+    'inferenceMaxWait': 0,  # Time in milliseconds to wait for more agents to be ready after the first one, 0 to not wait
     'startIter': 0,
     'numIters': 1000,
     'process_batch_size': 256,
+    'result_states': False,  # Send the final states of the games with their results instead of only the winners and lengths
+    'sample_buffer_size': None,  # Number of samples in the shared ring buffer of each self play worker, None for 4 * process_batch_size
+    'process_batch_splits': 1,  # Groups of games per worker with their own batches, searched while the others are evaluated
+    'persistent_agents': False,  # Keep the self play agents with their unfinished games and trees running across iterations
     'train_batch_size': 1024,
     'arena_batch_size': 64,
     'train_steps_per_iteration': 64,
@@ -60,6 +70,28 @@ DEFAULT_ARGS = dotdict({
     'numWarmupSims': 5,
     'probFastSim': 0.75,
     'mctsResetThreshold': None,
+    'mctsLeavesPerTree': 1,  # Number of leaves selected from each tree per NN batch using virtual loss
+    'mctsTranspositions': False,  # Share nodes of repeated positions in the tree, requires the game state to be hashable
+    'mctsSolver': False,  # Propagate proven wins, losses and draws up the search tree
+    'mctsWideningConstant': None,  # Progressive widening: search the ceil(c * n^exponent) children with the highest priors, None to disable
+    'mctsWideningExponent': 0.5,
+    'mctsMaxNodes': None,  # Node budget of each tree, the least visited subtrees are pruned when the root is updated
+    'mctsProcessMaxNodes': None,  # Node budget of all trees of a self play worker, shared equally between its trees when exceeded
+    'mctsEarlyStop': False,  # Stop the search of a move once the most visited root child can't be overtaken anymore
+    'mctsEarlyStopKL': None,  # Also stop once the KL divergence of the root visits between two checks is below this value
+    'mctsGumbel': False,  # Gumbel root search with sequential halving, trains on the improved policy instead of the visit counts
+    'mctsGumbelConsidered': 16,  # Number of root children sampled for sequential halving in the Gumbel root search
+    'mctsTimePerMove': None,  # Time in milliseconds that MCTSPlayer may search each move, None to search numMCTSSims
+    'mctsGameTime': None,  # Time in milliseconds on the game clock of MCTSPlayer, which is divided between its moves
+    'mctsTimeIncrement': 0,  # Time in milliseconds that is added to the game clock after each move
+    'mctsSearchMaxNodes': None,  # Stop the search of a move once the tree has this many nodes
+    'mctsPonder': False,  # MCTSPlayer keeps searching its tree in the background while the other players move
+    'resignThreshold': None,  # Initial root value below which a player resigns a self play game, None to play all games out
+    'resignMoves': 3,  # Number of moves in a row that the root value of a player must be below the threshold to resign
+    'resignPlayoutFraction': 0.1,  # Fraction of the self play games that are played out to calibrate the threshold
+    'resignFalsePositiveRate': 0.05,  # The threshold is adjusted so that at most this fraction of games is resigned falsely
+    'mctsProfile': False,  # Collect timings and counters of the search in self play and write them to tensorboard
+    'mctsEvaluatorThreads': 1,  # Number of threads that search the shared tree of the MCTSEvaluator of the GUI
     'startTemp': 1,
     'temp_scaling_fn': default_temp_scaling,
     'root_policy_temp': 1.1,
@@ -105,6 +137,7 @@ DEFAULT_ARGS = dotdict({
     }),
 
     'nnet_type': 'resnet',  # 'resnet' or 'fc'
+    'nnet_cache_mb': 0,  # Memory budget of the cache of network evaluations in MB, 0 to disable
     'num_channels': 32,
     'depth': 4,
     'value_head_channels': 16,
@@ -194,16 +227,22 @@ class Coach:
         self.policy_tensors = []
         self.value_tensors = []
         self.batch_ready = []
+        self.control_queues = []
         self.stop_train = mp.Event()
         self.pause_train = mp.Event()
         self.stop_agents = mp.Event()
         self.train_net.stop_train = self.stop_train
         self.train_net.pause_train = self.pause_train
         self.ready_queue = mp.Queue()
-        self.file_queue = mp.Queue()
+        self.sample_buffer = None
+        self.samples = []
         self.result_queue = mp.Queue()
+        # the final states of the games of the last iteration if result_states is set
+        self.game_states = []
         self.completed = mp.Value('i', 0)
         self.games_played = mp.Value('i', 0)
+        self.search_stats = new_search_stats()
+        self.resign_threshold = self.args.get('resignThreshold')
         if self.args.run_name != '':
             self.writer = SummaryWriter(log_dir='runs/' + self.args.run_name)
         else:
@@ -243,7 +282,13 @@ class Coach:
                     elif self.warmup:
                         self.warmup = False
 
-                    self.generateSelfPlayAgents()
+                    # the warmup agents don't use the network and have a different batch layout
+                    if self.agents and self.agents[0]._is_warmup != self.warmup:
+                        self.killSelfPlayAgents()
+                    if self.agents:
+                        self.resumeSelfPlayAgents()
+                    else:
+                        self.generateSelfPlayAgents()
                     self.processSelfPlayBatches(self.model_iter)
                     if self.stop_train.is_set():
                         break
@@ -253,9 +298,10 @@ class Coach:
                     self.processGameResults(self.model_iter)
                     if self.stop_train.is_set():
                         break
-                    self.killSelfPlayAgents()
-                    if self.stop_train.is_set():
-                        break
+                    if not self.args.get('persistent_agents'):
+                        self.killSelfPlayAgents()
+                        if self.stop_train.is_set():
+                            break
 
                 self.train(self.model_iter)
                 if self.stop_train.is_set():
@@ -291,57 +337,95 @@ class Coach:
     def generateSelfPlayAgents(self):
         self.stop_agents = mp.Event()
         self.ready_queue = mp.Queue()
+        self.sample_buffer = SampleBuffer(
+            self.game_cls, self.args.workers,
+            self.args.get('sample_buffer_size') or 4 * self.args.process_batch_size
+        )
+        self.samples = []
+        # the batches of each group of games of an agent are evaluated separately, the
+        # tensors and events of group k of agent i are at index i * splits + k
+        splits = 1 if self.warmup else self.args.get('process_batch_splits', 1)
+        split_size = self.args.process_batch_size // splits
         for i in range(self.args.workers):
-            self.input_tensors.append(torch.zeros(
-                [self.args.process_batch_size, *self.game_cls.observation_size()]
-            ))
-            self.input_tensors[i].share_memory_()
-
-            self.policy_tensors.append(torch.zeros(
-                [self.args.process_batch_size, self.game_cls.action_size()]
-            ))
-            self.policy_tensors[i].share_memory_()
-
-            self.value_tensors.append(torch.zeros(
-                [self.args.process_batch_size, self.game_cls.num_players() + 1]
-            ))
-            self.value_tensors[i].share_memory_()
-            self.batch_ready.append(mp.Event())
-
-            if self.args.cuda:
-                self.input_tensors[i].pin_memory()
-                self.policy_tensors[i].pin_memory()
-                self.value_tensors[i].pin_memory()
-
+            for j in range(i * splits, (i + 1) * splits):
+                self.input_tensors.append(torch.zeros(
+                    [split_size, *self.game_cls.observation_size()]
+                ))
+                self.input_tensors[j].share_memory_()
+
+                self.policy_tensors.append(torch.zeros(
+                    [split_size, self.game_cls.action_size()]
+                ))
+                self.policy_tensors[j].share_memory_()
+
+                self.value_tensors.append(torch.zeros(
+                    [split_size, self.game_cls.num_players() + 1]
+                ))
+                self.value_tensors[j].share_memory_()
+                self.batch_ready.append(mp.Event())
+
+                if self.args.cuda:
+                    self.input_tensors[j].pin_memory()
+                    self.policy_tensors[j].pin_memory()
+                    self.value_tensors[j].pin_memory()
+
+            agent_tensors = [
+                tensors[i] if splits == 1 else tensors[i * splits:(i + 1) * splits]
+                for tensors in (self.batch_ready, self.input_tensors, self.policy_tensors, self.value_tensors)
+            ]
+            if self.args.get('persistent_agents'):
+                self.control_queues.append(mp.Queue())
             self.agents.append(
-                SelfPlayAgent(i, self.game_cls, self.ready_queue, self.batch_ready[i],
-                              self.input_tensors[i], self.policy_tensors[i], self.value_tensors[i], self.file_queue,
+                SelfPlayAgent(i, self.game_cls, self.ready_queue, *agent_tensors, None,
                               self.result_queue, self.completed, self.games_played, self.stop_agents, self.pause_train,
-                              self.args, _is_warmup=self.warmup)
+                              self.args, _is_warmup=self.warmup, search_stats=self.search_stats,
+                              resign_threshold=self.resign_threshold, sample_buffer=self.sample_buffer,
+                              control_queue=self.control_queues[i] if self.control_queues else None)
             )
             self.agents[i].daemon = True
             self.agents[i].start()
 
+    @_set_state(TrainState.INIT_AGENTS)
+    def resumeSelfPlayAgents(self):
+        """Start the next iteration of the persistent self play agents. The agents carry on with
+        the games that were not finished in the last iteration, and the batches of their trees
+        are evaluated by the current network.
+        """
+        self.completed.value = 0
+        self.games_played.value = 0
+        reset_search_stats(self.search_stats)
+        message = dotdict({
+            'args': dotdict({
+                key: self.args[key] for key in ('gamesPerIteration', 'numMCTSSims', 'numFastSims', 'probFastSim')
+            }),
+            'resign_threshold': self.resign_threshold
+        })
+        for queue in self.control_queues:
+            queue.put(message)
+
     @_set_state(TrainState.SELF_PLAY)
     def processSelfPlayBatches(self, iteration):
         sample_time = AverageMeter()
         bar = Bar('Generating Samples', max=self.args.gamesPerIteration)
         end = time()
 
+        nnet = self.self_play_net if self.args.model_gating else self.train_net
+        server = InferenceServer(
+            self.ready_queue, self.policy_tensors, self.value_tensors, self.batch_ready,
+            self.args.get('inferenceBatchSize'), self.args.get('inferenceMaxWait', 0) / 1000
+        )
+
         n = 0
         while self.completed.value != self.args.workers:
             if self.stop_train.is_set() and not self.stop_agents.is_set():
                 self.stop_agents.set()
 
-            try:
-                id = self.ready_queue.get(timeout=1)
-                nnet = self.self_play_net if self.args.model_gating else self.train_net
-                policy, value = nnet.process(self.input_tensors[id])
-                self.policy_tensors[id].copy_(policy)
-                self.value_tensors[id].copy_(value)
-                self.batch_ready[id].set()
-            except Empty:
-                pass
+            process_time, = server.process([nnet.process], lambda id: [self.input_tensors[id]])
+            if process_time:
+                with self.search_stats.time.get_lock():
+                    self.search_stats.time[0] += process_time
+            # the agents wait while their ring of the buffer is full
+            self.samples.extend(self.sample_buffer.read())
 
             size = self.games_played.value
             if size > n:
@@ -354,25 +438,98 @@ class Coach:
             self.iter_time = bar.elapsed_td
             self.eta = bar.eta_td
 
-        if not self.stop_agents.is_set(): self.stop_agents.set()
+        if not self.stop_agents.is_set() and not self.control_queues: self.stop_agents.set()
         bar.update()
         bar.finish()
         self.writer.add_scalar('loss/sample_time', sample_time.avg, iteration)
+        if server.evaluations:
+            self.writer.add_scalar('mcts/inference_batch_size', server.batch_size(), iteration)
+        if nnet.cache is not None:
+            stats = nnet.cache.stats()
+            self.writer.add_scalar('cache/hit_rate', stats['hit_rate'], iteration)
+            self.writer.add_scalar('cache/hits', stats['hits'], iteration)
+            self.writer.add_scalar('cache/misses', stats['misses'], iteration)
+        moves = self.search_stats.moves[0]
+        if moves:
+            self.writer.add_scalar('mcts/sims_per_move', self.search_stats.sims[0] / moves, iteration)
+            self.writer.add_scalar('mcts/saved_sims_per_move', self.search_stats.saved_sims[0] / moves, iteration)
+        if self.search_stats.time[0]:
+            self.writer.add_scalar('mcts/sims_per_second', self.search_stats.sims[0] / self.search_stats.time[0], iteration)
+        self.writer.add_scalar('mcts/peak_process_nodes', self.search_stats.peak_nodes.value, iteration)
+        self.writer.add_scalar('mcts/evictions', self.search_stats.evictions.value, iteration)
+        self.writer.add_scalar('mcts/evicted_nodes', self.search_stats.evicted_nodes.value, iteration)
+        if self.args.get('mctsProfile'):
+            self.writeProfile(iteration)
+        if self.resign_threshold is not None and not self.warmup:
+            self.updateResignThreshold(iteration)
         print()
 
+    def updateResignThreshold(self, iteration):
+        """Write the resignation statistics of self play to tensorboard and set the resignation
+        threshold to the highest value at which at most resignFalsePositiveRate of the played
+        out games would have been resigned by a player who didn't lose.
+        """
+        stats = self.search_stats
+        games = self.games_played.value
+        playouts = stats.resign_playouts.value
+        self.writer.add_scalar('resign/threshold', self.resign_threshold, iteration)
+        if games:
+            self.writer.add_scalar('resign/resign_rate', stats.resigned.value / games, iteration)
+        if stats.resign_would_resign.value:
+            # estimated from the moves that the played out games went on for after they would have been resigned
+            moves_per_game = stats.resign_playout_moves.value / stats.resign_would_resign.value
+            self.writer.add_scalar('resign/saved_moves', stats.resigned.value * moves_per_game, iteration)
+        if not playouts:
+            return
+
+        calibration = np.array(stats.resign_calibration)
+        false_positives = np.cumsum(calibration)
+        current_bin = min(int(self.resign_threshold * RESIGN_CALIBRATION_BINS), RESIGN_CALIBRATION_BINS)
+        self.writer.add_scalar(
+            'resign/false_positive_rate',
+            false_positives[current_bin - 1] / playouts if current_bin else 0, iteration
+        )
+        # a threshold of k / bins resigns the games whose value is in one of the first k bins
+        allowed = self.args.get('resignFalsePositiveRate', 0.05) * playouts
+        num_bins = np.count_nonzero(false_positives[:RESIGN_CALIBRATION_BINS // 2] <= allowed)
+        self.resign_threshold = num_bins / RESIGN_CALIBRATION_BINS
+
+    def writeProfile(self, iteration):
+        """Write the profile statistics of the self play trees per simulation to tensorboard."""
+        profile = dict(zip(PROFILE_STATS, self.search_stats.profile))
+        sims = profile.pop('sims')
+        if not sims:
+            return
+        for key, value in profile.items():
+            if key.endswith('_time'):
+                self.writer.add_scalar(f'profile/{key[:-len("_time")]}_us_per_sim', 1e6 * value / sims, iteration)
+            else:
+                self.writer.add_scalar(f'profile/{key}_per_sim', value / sims, iteration)
+
+        histogram = np.array(self.search_stats.depth_histogram)
+        depths = np.flatnonzero(histogram)
+        if len(depths):
+            counts = histogram[depths[0]:depths[-1] + 1]
+            values = np.arange(depths[0], depths[-1] + 1)
+            self.writer.add_histogram_raw(
+                'profile/selection_depth', min=int(depths[0]), max=int(depths[-1]), num=int(counts.sum()),
+                sum=int((values * counts).sum()), sum_squares=int((values ** 2 * counts).sum()),
+                bucket_limits=(values + 0.5).tolist(), bucket_counts=counts.tolist(), global_step=iteration
+            )
+
     @_set_state(TrainState.SAVE_SAMPLES)
     def saveIterationSamples(self, iteration):
-        num_samples = self.file_queue.qsize()
+        self.samples.extend(self.sample_buffer.read())
+        num_samples = sum(len(data) for data, _, _ in self.samples)
         print(f'Saving {num_samples} samples')
 
-        data_tensor = torch.zeros([num_samples, *self.game_cls.observation_size()])
-        policy_tensor = torch.zeros([num_samples, self.game_cls.action_size()])
-        value_tensor = torch.zeros([num_samples, self.game_cls.num_players() + 1])
-        for i in range(num_samples):
-            data, policy, value = self.file_queue.get()
-            data_tensor[i] = torch.from_numpy(data)
-            policy_tensor[i] = torch.from_numpy(policy)
-            value_tensor[i] = torch.from_numpy(value)
+        if self.samples:
+            data_tensor, policy_tensor, value_tensor = (torch.cat(chunks) for chunks in zip(*self.samples))
+        else:
+            data_tensor = torch.zeros([0, *self.game_cls.observation_size()])
+            policy_tensor = torch.zeros([0, self.game_cls.action_size()])
+            value_tensor = torch.zeros([0, self.game_cls.num_players() + 1])
+        self.samples = []
 
         folder = os.path.join(self.args.data, self.args.run_name)
         filename = os.path.join(folder, get_iter_file(iteration).replace('.pkl', ''))
@@ -388,7 +545,10 @@ class Coach:
     @_set_state(TrainState.PROCESS_RESULTS)
     def processGameResults(self, iteration):
         num_games = self.result_queue.qsize()
-        wins, draws, avg_game_length = get_game_results(self.result_queue, self.game_cls)
+        self.game_states = []
+        wins, draws, avg_game_length = get_game_results(
+            self.result_queue, self.game_cls, states=self.game_states
+        )
 
         for i in range(len(wins)):
             self.writer.add_scalar(f'win_rate/player{i}', (
@@ -399,17 +559,14 @@ class Coach:
 
     @_set_state(TrainState.KILL_AGENTS)
     def killSelfPlayAgents(self):
+        # persistent agents wait for the next iteration until they are stopped
+        self.stop_agents.set()
         # clear queues to prevent deadlocking
         for _ in range(self.ready_queue.qsize()):
             try:
                 self.ready_queue.get_nowait()
             except Empty:
                 break
-        for _ in range(self.file_queue.qsize()):
-            try:
-                self.file_queue.get_nowait()
-            except Empty:
-                break
         for _ in range(self.result_queue.qsize()):
             try:
                 self.result_queue.get_nowait()
@@ -418,21 +575,22 @@ class Coach:
 
         for agent in self.agents:
             agent.join()
-            del self.input_tensors[0]
-            del self.policy_tensors[0]
-            del self.value_tensors[0]
-            del self.batch_ready[0]
 
         self.agents = []
         self.input_tensors = []
         self.policy_tensors = []
         self.value_tensors = []
         self.batch_ready = []
+        self.control_queues = []
         self.ready_queue = mp.Queue()
-        self.file_queue = mp.Queue()
+        self.sample_buffer = None
+        self.samples = []
         self.result_queue = mp.Queue()
+        # the final states of the games of the last iteration if result_states is set
+        self.game_states = []
         self.completed = mp.Value('i', 0)
         self.games_played = mp.Value('i', 0)
+        self.search_stats = new_search_stats()
 
     @_set_state(TrainState.TRAIN)
     def train(self, iteration):
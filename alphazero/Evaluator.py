@@ -327,10 +327,16 @@ class MCTSEvaluator(BaseEvaluator):
     def __init__(self, args=DEFAULT_ARGS,
                  model: Union[Callable[[GameState], Tuple[np.ndarray, np.ndarray]], NNetWrapper] = None,
                  num_sims: int = None, max_search_depth: int = None, max_search_time: float = None,
-                 best_actions_temp: float = 1, average_children=False):
+                 best_actions_temp: float = 1, average_children=False, leaves_per_batch: int = 1,
+                 num_threads: int = 1):
         super().__init__(model)
         self.average_children = average_children
         self.best_actions_temp = best_actions_temp
+        self.leaves_per_batch = leaves_per_batch
+        self.num_threads = num_threads
+        self._batch_model = None
+        if isinstance(model, NNetWrapper):
+            self._batch_model = lambda states: model.predict_batch(np.array([s.observation() for s in states]))
 
         self.num_sims = num_sims
         self.max_search_depth = max_search_depth
@@ -340,6 +346,10 @@ class MCTSEvaluator(BaseEvaluator):
 
     def _search(self, state: GameState, model: Callable[[GameState], Tuple[np.ndarray, np.ndarray]],
                 sims: int = None, add_root_noise: bool = False, add_root_temp: bool = False):
+        if self.num_threads > 1:
+            self._parallel_search(state, model, sims, add_root_noise, add_root_temp)
+            return
+
         self._mcts.max_depth = 0
         num_sims = 0
         start_time = time.time()
@@ -347,21 +357,112 @@ class MCTSEvaluator(BaseEvaluator):
         while (num_sims < sims) if sims else True:
             if self._stop_event.is_set():
                 break
+            if self._mcts.root_result() is not None:
+                # the result of the game is already known
+                self._stop_event.set()
+                break
 
-            leaf = self._mcts.find_leaf(state)
-            p, v = model(leaf)
-            self._mcts.process_results(leaf, v, p, add_root_noise, add_root_temp)
+            if self.leaves_per_batch > 1:
+                leaves = self._mcts.find_leaves(
+                    state, min(self.leaves_per_batch, sims - num_sims) if sims else self.leaves_per_batch
+                )
+                p, v = self._predict_batch(leaves, model)
+                self._mcts.process_results_batch(state, v, p, add_root_noise, add_root_temp)
+                new_sims = len(leaves)
+            else:
+                leaf = self._mcts.find_leaf(state)
+                p, v = model(leaf)
+                self._mcts.process_results(leaf, v, p, add_root_noise, add_root_temp)
+                new_sims = 1
             self._set_value(self._mcts.value(average=self.average_children))
 
-            if (
-                self.max_search_depth is not None and self._mcts.max_depth > self.max_search_depth
-                or self.max_search_time is not None and time.time() - start_time > self.max_search_time
-            ):
+            if self._limit_reached(start_time):
                 self._stop_event.set()
                 break
-            num_sims += 1
+            num_sims += new_sims
             self._curr_num_sims = num_sims
 
+    def _parallel_search(self, state: GameState, model: Callable[[GameState], Tuple[np.ndarray, np.ndarray]],
+                         sims: int = None, add_root_noise: bool = False, add_root_temp: bool = False):
+        """Search the shared tree with num_threads threads. Each thread selects a batch of
+        leaves with virtual loss while holding the tree lock, evaluates the batch with a
+        single call of the model while the other threads use the tree, and then backs up
+        the results. The lock is only held for the selection and the backup, so the
+        evaluations of the threads run in parallel. If a thread fails, the others are
+        stopped and its exception is raised once all threads finished.
+        """
+        self._mcts.max_depth = 0
+        self._curr_num_sims = 0
+        start_time = time.time()
+        tree_lock = threading.Lock()
+        # number of simulations that were selected, including the ones that are still evaluated
+        selected = 0
+        # the first exception raised by a thread
+        error = None
+
+        def search():
+            nonlocal selected
+            while not self._stop_event.is_set():
+                with tree_lock:
+                    if sims and selected >= sims:
+                        break
+                    if self._mcts.root_result() is not None or self._limit_reached(start_time):
+                        self._stop_event.set()
+                        break
+                    leaves = self._mcts.find_leaves(
+                        state, min(self.leaves_per_batch, sims - selected) if sims else self.leaves_per_batch
+                    )
+                    pending = self._mcts.take_pending()
+                    selected += len(leaves)
+                if not leaves:
+                    # the leaves that would be selected are still evaluated by other threads
+                    time.sleep(0)
+                    continue
+
+                try:
+                    p, v = self._predict_batch(leaves, model)
+                except BaseException:
+                    # release the leaves, so that the tree can still be searched
+                    with tree_lock:
+                        self._mcts.discard_pending(pending)
+                    raise
+                with tree_lock:
+                    self._mcts.process_pending(pending, state, v, p, add_root_noise, add_root_temp)
+                    self._curr_num_sims += len(leaves)
+                    self._set_value(self._mcts.value(average=self.average_children))
+
+        def worker():
+            nonlocal error
+            try:
+                search()
+            except BaseException as e:
+                with tree_lock:
+                    if error is None:
+                        error = e
+                # the other threads could wait forever for the leaves of this thread
+                self._stop_event.set()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if error is not None:
+            raise error
+
+    def _limit_reached(self, start_time: float) -> bool:
+        return (
+            self.max_search_depth is not None and self._mcts.max_depth > self.max_search_depth
+            or self.max_search_time is not None and time.time() - start_time > self.max_search_time
+        )
+
+    def _predict_batch(self, leaves: List[GameState],
+                       model: Callable[[GameState], Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        if self._batch_model is not None:
+            return self._batch_model(leaves)
+        p, v = zip(*[model(leaf) for leaf in leaves])
+        return np.array(p, dtype=np.float32), np.array(v, dtype=np.float32)
+
     def _run(self, state: GameState, *args, **kwargs) -> None:
         if self.model is None:
             # always use uniform value and policy if no model is given
@@ -46,6 +46,14 @@ class GameState(ABC):
         """Returns a numpy binary array containing zeros for invalid moves and ones for valids."""
         pass
 
+    def legal_actions(self) -> np.ndarray:
+        """
+        Returns the indices of the valid moves in increasing order as an int32 array,
+        which MCTS uses to expand its nodes. Games can override it to build the array
+        directly instead of the binary vector of valid_moves.
+        """
+        return np.flatnonzero(self.valid_moves()).astype(np.int32)
+
     @staticmethod
     @abstractmethod
     def num_players() -> int:
@@ -62,6 +70,15 @@ class GameState(ABC):
         """Returns True if the game has a draw condition."""
         return True
 
+    @staticmethod
+    def supports_undo() -> bool:
+        """
+        Returns True if the game implements undo_action. MCTS then selects its leaves
+        by playing and undoing actions on a single state instead of cloning the state
+        for every simulation.
+        """
+        return False
+
     @property
     def player(self) -> int:
         return self._player
@@ -83,6 +100,20 @@ class GameState(ABC):
         """Play the action in the current state given by argument action."""
         self.last_action = action
 
+    def undo_action(self) -> None:
+        """
+        Take back the last action played in the current state, including its change of
+        the player, the turn and last_action. This is an optional method, only actions
+        played since the state was created or cloned have to be undone.
+        Games that implement it must return True from supports_undo.
+        """
+        raise NotImplementedError('undo_action not implemented for this environment.')
+
+    def _undo_turn(self) -> None:
+        """Should be called at the end of undo_action"""
+        self._player = self._next_player(self._player, -1)
+        self._turns -= 1
+
     @abstractmethod
     def win_state(self) -> np.ndarray:
         """
@@ -4,10 +4,17 @@ from alphazero.NNetWrapper import NNetWrapper
 from alphazero.utils import dotdict, plot_mcts_tree
 
 from abc import ABC, abstractmethod
+from typing import Optional
 
 import numpy as np
+import threading
 import torch
 
+# Number of moves that the remaining time on the game clock is divided between.
+_CLOCK_MOVES_TO_GO = 30
+# Upper bound of the number of simulations of a timed search.
+_TIMED_SEARCH_SIMS = 2 ** 31 - 1
+
 
 class BasePlayer(ABC):
     def __init__(self, game_cls: GameState = None, args: dotdict = None, verbose: bool = False):
@@ -36,6 +43,12 @@ class BasePlayer(ABC):
     def reset(self):
         pass
 
+    def search_stats(self) -> Optional[dict]:
+        """Get the number of simulations run and saved by the search of the last move,
+        or None if the player doesn't search.
+        """
+        return None
+
     @abstractmethod
     def play(self, state: GameState) -> int:
         pass
@@ -107,6 +120,13 @@ class MCTSPlayer(BasePlayer):
         self.average_value = average_value
         self.draw_mcts = draw_mcts
         self.draw_depth = draw_depth
+        # background search of the tree between the moves of the player, ponder_sims
+        # is the number of simulations that were pondered before the last move
+        self.ponder = self.args.get('mctsPonder', False)
+        self.ponder_sims = 0
+        self._pondered = 0
+        self._ponder_thread = None
+        self._ponder_stop = threading.Event()
         self.reset()
         if self.verbose:
             self.mcts.search(
@@ -125,13 +145,98 @@ class MCTSPlayer(BasePlayer):
         return True
 
     def update(self, state: GameState, action: int) -> None:
+        self.stop_pondering()
         self.mcts.update_root(state, action)
+        if self.ponder:
+            state = state.clone()
+            state.play_action(action)
+            if not state.win_state().any():
+                self.start_pondering(state)
 
     def reset(self):
+        self.stop_pondering()
         self.mcts = MCTS(self.args)
+        # remaining time on the game clock in milliseconds, None if the game isn't timed
+        self.clock = self.args.get('mctsGameTime')
+
+    def search_stats(self) -> Optional[dict]:
+        return dict(sims=self.mcts.num_sims, saved_sims=self.mcts.saved_sims, time=self.mcts.search_time)
+
+    def _time_limit(self, state: GameState) -> float:
+        """Get the time in seconds that the search of the move may take, which is the smaller
+        of the time per move and the share of the game clock of the move, or 0 if the search isn't timed.
+        """
+        time_limit = self.args.get('mctsTimePerMove') or 0
+        if self.clock is not None:
+            moves_to_go = _CLOCK_MOVES_TO_GO
+            if state.max_turns():
+                moves_to_go = min(moves_to_go, max(1, (state.max_turns() - state.turns) // state.num_players()))
+            clock_limit = min(self.clock / moves_to_go + (self.args.get('mctsTimeIncrement') or 0), self.clock)
+            time_limit = min(time_limit, clock_limit) if time_limit else clock_limit
+        elif not time_limit:
+            return 0
+        # keep searching at least for a moment if the clock ran out
+        return max(time_limit, 1) / 1000
+
+    def _timed_search(self, state: GameState) -> None:
+        self.stop_pondering()
+        self.ponder_sims = self._pondered
+        self._pondered = 0
+        time_limit = self._time_limit(state)
+        # the Gumbel root search divides a fixed budget of simulations between the root children
+        sims = self.args.numMCTSSims if not time_limit or self.args.get('mctsGumbel', False) \
+            else _TIMED_SEARCH_SIMS
+        self._search(state, sims, time_limit)
+        if self.clock is not None:
+            self.clock += (self.args.get('mctsTimeIncrement') or 0) - self.mcts.search_time * 1000
+
+    def start_pondering(self, state: GameState) -> None:
+        """Keep searching the tree of state in a background thread until
+        stop_pondering is called, which happens on the next update, play or reset.
+        The tree of the move that is played next is kept by the update.
+        """
+        self.stop_pondering()
+        self._ponder_stop.clear()
+        self._ponder_thread = threading.Thread(target=self._ponder, args=(state,), daemon=True)
+        self._ponder_thread.start()
+
+    def stop_pondering(self) -> None:
+        if self._ponder_thread is None:
+            return
+        self._ponder_stop.set()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+
+    def _ponder(self, state: GameState) -> None:
+        # the Gumbel root search falls back to PUCT once the schedule of numMCTSSims is used up
+        self.mcts.start_search(self.args.numMCTSSims)
+        while not self._ponder_stop.is_set() and not self.mcts.search_done(_TIMED_SEARCH_SIMS):
+            leaf = self.mcts.find_leaf(state)
+            p, v = self._evaluate(leaf)
+            self.mcts.process_results(leaf, v, p, False, False)
+            self._pondered += 1
+
+    def _evaluate(self, state: GameState):
+        return self.nn(state.observation())
+
+    def _search(self, state: GameState, sims: int, time_limit: float) -> None:
+        leaves_per_batch = self.args.get('mctsLeavesPerTree', 1)
+        if leaves_per_batch > 1:
+            self.mcts.batch_search(
+                state, self.nn.predict_batch, sims, leaves_per_batch,
+                self.args.add_root_noise, self.args.add_root_temp, time_limit
+            )
+        else:
+            self.mcts.search(state, self.nn, sims, self.args.add_root_noise, self.args.add_root_temp, time_limit)
+
+    def _choose_action(self, state: GameState, policy: np.ndarray) -> int:
+        # the Gumbel root search already sampled the move with its Gumbel noise
+        if self.args.get('mctsGumbel', False):
+            return self.mcts.best_action(state)
+        return np.random.choice(len(policy), p=policy)
 
     def play(self, state) -> int:
-        self.mcts.search(state, self.nn, self.args.numMCTSSims, self.args.add_root_noise, self.args.add_root_temp)
+        self._timed_search(state)
         self.temp = self.args.temp_scaling_fn(self.temp, state.turns, state.max_turns())
         policy = self.mcts.probs(state, self.temp)
 
@@ -141,6 +246,7 @@ class MCTSPlayer(BasePlayer):
         if self.verbose:
             _, value = self.nn.predict(state.observation())
             print('max tree depth:', self.mcts.max_depth)
+            print(f'simulations: {self.mcts.num_sims} ({self.mcts.saved_sims} saved, {self.ponder_sims} pondered)')
             print(f'raw network value: {value}')
 
             value = self.mcts.value(self.average_value)
@@ -153,7 +259,7 @@ class MCTSPlayer(BasePlayer):
         if self.draw_mcts:
             plot_mcts_tree(self.mcts, max_depth=self.draw_depth)
 
-        action = np.random.choice(len(policy), p=policy)
+        action = self._choose_action(state, policy)
         if self.verbose:
             print('confidence of action:', policy[action])
 
@@ -169,6 +275,8 @@ class RawMCTSPlayer(MCTSPlayer):
         self._POLICY_SIZE = self.game_cls.action_size()
         self._POLICY_FILL_VALUE = 1 / self._POLICY_SIZE
         self._VALUE_SIZE = self.game_cls.num_players() + 1
+        self._POLICY = np.full(self._POLICY_SIZE, 1, dtype=np.float32)
+        self._VALUE = np.zeros(self._VALUE_SIZE, dtype=np.float32)
 
     @staticmethod
     def supports_process() -> bool:
@@ -178,14 +286,21 @@ class RawMCTSPlayer(MCTSPlayer):
     def requires_model() -> bool:
         return False
 
+    def _evaluate(self, state: GameState):
+        return self._POLICY, self._VALUE
+
+    def _search(self, state: GameState, sims: int, time_limit: float) -> None:
+        self.mcts.raw_search(state, sims, self.args.add_root_noise, self.args.add_root_temp, time_limit)
+
     def play(self, state) -> int:
-        self.mcts.raw_search(state, self.args.numMCTSSims, self.args.add_root_noise, self.args.add_root_temp)
+        self._timed_search(state)
         self.temp = self.args.temp_scaling_fn(self.temp, state.turns, state.max_turns())
         policy = self.mcts.probs(state, self.temp)
-        action = np.random.choice(len(policy), p=policy)
+        action = self._choose_action(state, policy)
 
         if self.verbose:
             print('max tree depth:', self.mcts.max_depth)
+            print(f'simulations: {self.mcts.num_sims} ({self.mcts.saved_sims} saved, {self.ponder_sims} pondered)')
             print(f'value for player {state.player}: {self.mcts.value(self.average_value)}')
             print(f'policy: {policy}')
             print('confidence of action:', policy[action])
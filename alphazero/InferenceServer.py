@@ -0,0 +1,96 @@
+from typing import Callable, List, Optional, Sequence, Tuple
+from queue import Empty
+
+import torch
+import time
+
+
+class InferenceServer:
+    """Evaluates the batches of several self play agents together. After an agent puts
+    its id on the ready queue, the ids of other ready agents are gathered until their
+    batches add up to max_batch_size rows or max_wait seconds passed. Every model is then
+    evaluated once on the rows of all gathered agents, and the results are copied into
+    the policy and value tensors of each agent before its batch_ready event is set.
+    """
+
+    def __init__(self, ready_queue, policy_tensors: List[torch.Tensor], value_tensors: List[torch.Tensor],
+                 batch_ready: list, max_batch_size: Optional[int] = None, max_wait: float = 0):
+        self.ready_queue = ready_queue
+        self.policy_tensors = policy_tensors
+        self.value_tensors = value_tensors
+        self.batch_ready = batch_ready
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # number of model evaluations and rows evaluated, for the average batch size
+        self.evaluations = 0
+        self.rows = 0
+
+    def process(self, models: Sequence[Callable], get_inputs: Callable[[int], list],
+                timeout: float = 1) -> List[float]:
+        """Evaluate the batches of the agents that are ready within timeout seconds.
+        get_inputs returns the inputs of the agent with the given id for each model, a
+        tensor of observations or an empty list if the agent has no rows for the model.
+        The results of an agent are written to its tensors model after model.
+        Returns the time in seconds spent evaluating each model.
+        """
+        times = [0.] * len(models)
+        ids, inputs = self._gather(get_inputs, timeout)
+        if not ids:
+            return times
+
+        policies = [[] for _ in ids]
+        values = [[] for _ in ids]
+        for i, model in enumerate(models):
+            batches = [agent_inputs[i] for agent_inputs in inputs]
+            rows = [len(batch) for batch in batches]
+            if not any(rows):
+                continue
+
+            start = time.perf_counter()
+            policy, value = model(torch.cat([batch for batch in batches if len(batch)]))
+            times[i] = time.perf_counter() - start
+            self.evaluations += 1
+            self.rows += len(policy)
+
+            offset = 0
+            for j, num_rows in enumerate(rows):
+                if num_rows:
+                    policies[j].append(policy[offset:offset + num_rows])
+                    values[j].append(value[offset:offset + num_rows])
+                    offset += num_rows
+
+        for j, id in enumerate(ids):
+            if policies[j]:
+                policy = torch.cat(policies[j])
+                value = torch.cat(values[j])
+                self.policy_tensors[id][:len(policy)].copy_(policy)
+                self.value_tensors[id][:len(value)].copy_(value)
+            self.batch_ready[id].set()
+
+        return times
+
+    def batch_size(self) -> float:
+        """The average number of rows per model evaluation."""
+        return self.rows / self.evaluations if self.evaluations else 0
+
+    def _gather(self, get_inputs: Callable[[int], list], timeout: float) -> Tuple[List[int], List[list]]:
+        try:
+            id = self.ready_queue.get(timeout=timeout)
+        except Empty:
+            return [], []
+
+        ids = [id]
+        inputs = [get_inputs(id)]
+        num_rows = sum(len(batch) for batch in inputs[0])
+        deadline = time.perf_counter() + self.max_wait
+        while self.max_batch_size is None or num_rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                id = self.ready_queue.get(timeout=remaining) if remaining > 0 else self.ready_queue.get_nowait()
+            except Empty:
+                break
+            ids.append(id)
+            inputs.append(get_inputs(id))
+            num_rows += sum(len(batch) for batch in inputs[-1])
+
+        return ids, inputs
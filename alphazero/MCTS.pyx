@@ -7,11 +7,13 @@
 # cython: cdivision=True
 # cython: auto_pickle=True
 
-from libc.math cimport sqrt
+from libc.math cimport sqrt, pow, ceil
 
 import numpy as np
 cimport numpy as np
 from alphazero.utils import dotdict
+from typing import Optional
+from time import perf_counter
 
 
 DTYPE = np.float32
@@ -20,115 +22,290 @@ ctypedef np.float32_t DTYPE_t
 NOISE_ALPHA_RATIO = 10.83
 _DRAW_VALUE = 0.5
 
+cdef enum:
+    # id of the root node and of the edge leading to it,
+    # both are always kept at the front of their pools
+    ROOT = 0
+
+# Initial number of nodes and edges allocated for the pools of each tree.
+_INITIAL_CAPACITY = 256
+
+# Number of root visits between the checks of the KL divergence early stopping criterion.
+_KL_CHECK_INTERVAL = 16
+
+# Scale of the completed Q values in the Gumbel root search, the defaults of the paper
+# (Danihelka et al., Policy improvement by planning with Gumbel, 2022).
+_GUMBEL_C_VISIT = 50
+_GUMBEL_C_SCALE = 0.1
+
+# Header of the binary tree snapshots of to_bytes: magic number, format version,
+# number of edges, number of nodes, number of players, discount depth and number of players of the game.
+_SNAPSHOT_MAGIC = 0x5354434d
+_SNAPSHOT_VERSION = 2
+_SNAPSHOT_HEADER_SIZE = 7
+# Edge and node arrays stored in a snapshot with their types, in the order they are written.
+_SNAPSHOT_EDGE_ARRAYS = (('_n', np.int32), ('_q', np.float32), ('_p', np.float32), ('_a', np.int32), ('_child', np.int32))
+_SNAPSHOT_NODE_ARRAYS = (
+    ('_v', np.float32), ('_player', np.int32), ('_terminal', np.uint32), ('_proven', np.uint32),
+    ('_first_child', np.int32), ('_num_children', np.int32), ('_seen_policy', np.float64),
+    ('_link', np.int32), ('_edge', np.int32)
+)
+
+# Statistics collected by MCTS with profiling enabled, in the order of profile_stats:
+# simulations backed up, nodes created, game state clones, actions played, calls of
+# win_state, legal_actions and observation, and the time in seconds spent in the selection
+# (cloning the state and playing the actions), expansion, observations and backup.
+PROFILE_STATS = (
+    'sims', 'nodes', 'clones', 'actions', 'win_states', 'legal_actions', 'observations',
+    'select_time', 'expand_time', 'observation_time', 'backup_time'
+)
+# Number of bins of the histogram of the selection depth, deeper selections are put into the last bin.
+PROFILE_MAX_DEPTH = 64
+
 np.seterr(all='raise')
 
 
-"""
-def rebuild_node(children, a, cpuct, num_players, e, q, n, p, player):
-    childs = []
-    for child_state in children:
-        rebuild, args = child_state[0], child_state[1:]
-        child = rebuild(*args)
-        childs.append(child)
+cdef np.ndarray _resized(np.ndarray arr, Py_ssize_t size, Py_ssize_t capacity):
+    cdef np.ndarray new_arr = np.empty(capacity, dtype=arr.dtype)
+    new_arr[:size] = arr[:size]
+    return new_arr
 
-    node = Node(a, cpuct, num_players)
-    node._children = childs
-    node.a = a
-    node.cpuct = cpuct
-    node.e = e
-    node.q = q
-    node.n = n
-    node.p = p
-    node.player = player
 
-    return node
-"""
+cdef bint _supports_undo(object gs):
+    """Check if the game implements undo_action, see GameState.supports_undo.
+    Games that don't derive from GameState are always cloned.
+    """
+    cdef object supports_undo = getattr(gs, 'supports_undo', None)
+    return supports_undo is not None and supports_undo()
 
 
-# @cython.auto_pickle(True)
-cdef class Node:
-    cdef public list _children
-    cdef public int a
-    cdef public np.ndarray e
-    cdef public float q
-    cdef public float v
-    cdef public int n
-    cdef public float p
-    cdef public int player
-
-    def __init__(self, int action, int num_players):
-        self._children = []
-        self.a = action
-        self.e = np.zeros(num_players, dtype=np.uint8)
-        self.q = 0
-        self.v = 0
-        self.n = 0
-        self.p = 0
-        self.player = 0
+cdef np.ndarray _legal_actions(object gs):
+    """Get the legal actions of the game, see GameState.legal_actions.
+    They are derived from valid_moves for games that don't implement it.
+    """
+    cdef object legal_actions = getattr(gs, 'legal_actions', None)
+    if legal_actions is None:
+        return np.flatnonzero(gs.valid_moves())
+    return legal_actions()
 
-    def __repr__(self):
-        return 'Node(a={}, e={}, q={}, v={}, n={}, p={}, player={})' \
-            .format(self.a, self.e, self.q, self.v, self.n, self.p, self.player)
 
-    # def __reduce__(self):
-    #    return rebuild_node, ([n.__reduce__() for n in self._children], self.a, self.cpuct, self._players, self.e, self.q, self.n, self.p, self.player)
+cdef unsigned int _win_state_mask(np.ndarray win_state):
+    """Pack the boolean win state array of a game into a bit mask,
+    so that it can be stored in the terminal array of the node pool.
+    """
+    cdef unsigned int mask = 0
+    cdef Py_ssize_t i
+    for i in range(len(win_state)):
+        if win_state[i]:
+            mask |= 1u << i
+    return mask
 
-    cdef void add_children(self, np.ndarray v, int num_players):
-        self._children.extend([Node(a, num_players) for a, valid in enumerate(v) if valid])
-        # shuffle children
-        np.random.shuffle(self._children)
-
-    cdef void update_policy(self, float[:] pi):
-        cdef Node c
-        for c in self._children:
-            c.p = pi[c.a]
-
-    cdef float uct(self, float sqrt_parent_n, float fpu_value, float cpuct):
-        return (fpu_value if self.n == 0 else self.q) + cpuct * self.p * sqrt_parent_n / (1 + self.n)
-
-    cdef Node best_child(self, float fpu_reduction, float cpuct):
-        cdef Node c
-        cdef float seen_policy = sum([c.p for c in self._children if c.n > 0])
-        cdef float fpu_value = self.v - fpu_reduction * sqrt(seen_policy)
-        cdef float cur_best = -float('inf')
-        cdef float sqrt_n = sqrt(self.n)
-        cdef float uct
-        child = None
-
-        for c in self._children:
-            uct = c.uct(sqrt_n, fpu_value, cpuct)
-            if uct > cur_best:
-                cur_best = uct
-                child = c
 
-        return child
+cdef inline float _mask_value(unsigned int mask, int player, int num_players):
+    """Get the value of a win state bit mask for the given player, a draw is
+    shared between all players.
+    """
+    return ((mask >> player) & 1) + <float>((mask >> num_players) & 1) / num_players
+
+
+cdef np.ndarray _mask_to_value(unsigned int mask, Py_ssize_t size):
+    cdef np.ndarray[dtype=np.float32_t, ndim=1] value = np.zeros(size, dtype=np.float32)
+    cdef Py_ssize_t i
+    for i in range(size):
+        value[i] = (mask >> i) & 1
+    return value
+
 
+cdef np.ndarray _considered_visits(int max_considered, int sims):
+    """Get the number of visits that the root child selected by the Gumbel root search
+    must have at each simulation, so that sequential halving spreads the simulations
+    evenly over log2(max_considered) phases, halving the considered children each phase.
+    """
+    cdef list sequence = []
+    cdef list visits = [0] * max_considered
+    cdef int num_considered = max_considered
+    cdef int log2_max = <int>ceil(np.log2(max_considered)) if max_considered > 1 else 1
+    cdef int num_extra_visits, i
 
-"""
-def rebuild_mcts(num_players, cpuct, root, curnode, path):
-    mcts = MCTS(num_players, cpuct)
-    mcts.cpuct = cpuct
-    mcts._root = root
-    mcts._curnode = curnode
-    mcts.path = path
-    return mcts
-"""
+    if max_considered <= 1:
+        return np.arange(sims, dtype=np.int32)
+    while len(sequence) < sims:
+        num_extra_visits = max(1, sims // (log2_max * num_considered))
+        for _ in range(num_extra_visits):
+            sequence.extend(visits[:num_considered])
+            for i in range(num_considered):
+                visits[i] += 1
+        num_considered = max(2, num_considered // 2)
+
+    return np.array(sequence[:sims], dtype=np.int32)
+
+
+cdef int _select_child(int first, int last, float parent_v, double seen_policy, int parent_n,
+                       int[::1] n, float[::1] q, float[::1] p, int[::1] virtual_loss,
+                       int[::1] child, unsigned int[::1] proven, unsigned int non_loss_mask,
+                       float fpu_reduction, float cpuct):
+    """Select the edge in the block [first, last) with the highest PUCT score
+    in a single pass over the contiguous visit, Q and prior buffers. Edges that
+    haven't been visited yet use the first play urgency (FPU) value as their Q.
+    Pending virtual visits of an edge are counted as visits with a lost value.
+    If non_loss_mask is not 0, edges leading to nodes that are proven to be lost
+    (none of the bits of non_loss_mask are set in their proven result) are skipped.
+    """
+    cdef float fpu_value = parent_v - fpu_reduction * sqrt(seen_policy)
+    cdef float sqrt_n = sqrt(parent_n)
+    cdef float cur_best = -float('inf')
+    cdef float uct, child_q
+    cdef int best = -1
+    cdef int c, child_n
+
+    for c in range(first, last):
+        if non_loss_mask and child[c] != -1 and proven[child[c]] and not proven[child[c]] & non_loss_mask:
+            continue
+        if virtual_loss[c] == 0:
+            child_n = n[c]
+            child_q = fpu_value if child_n == 0 else q[c]
+        else:
+            child_n = n[c] + virtual_loss[c]
+            child_q = q[c] * n[c] / child_n
+        uct = child_q + cpuct * p[c] * sqrt_n / (1 + child_n)
+        if uct > cur_best:
+            cur_best = uct
+            best = c
+
+    return best
 
 
 # @cython.auto_pickle(True)
 cdef class MCTS:
+    """Monte Carlo Tree Search using struct-of-arrays edge and node pools.
+
+    Every move of an expanded position is an edge, an int id indexing into the
+    contiguous edge arrays (action, prior, visits, Q, ...). The edges of the legal
+    moves of a node are allocated as one contiguous block when the node is
+    expanded. The node an edge leads to (value, player, terminal state, edges, ...)
+    is only created in the node pool the first time the edge is selected. The root
+    is always node `ROOT`, reached by edge `ROOT`. When the root is moved down the
+    tree by `update_root`, the subtree that is kept is compacted to the front of
+    the pools and all other nodes and edges are recycled for later expansions.
+    """
     cdef public float root_noise_frac
     cdef public float root_temp
     cdef public float min_discount
     cdef public float fpu_reduction
     cdef public float cpuct
     cdef public int _num_players
-    cdef public Node _root
-    cdef public Node _curnode
-    cdef public list _path
+    cdef public int _curedge
     cdef public int depth
     cdef public int max_depth
     cdef public int _discount_max_depth
+    cdef public bint use_solver
+    # progressive widening, only the ceil(c * n^exponent) children with the
+    # highest priors of a node with n visits are searched (disabled if c is 0)
+    cdef public float widening_constant
+    cdef public float widening_exponent
+    # number of players of the game, set during backup for the solver
+    cdef public int _game_players
+    # maximum number of nodes kept in the tree when the root is updated (0 for no limit)
+    cdef public int max_nodes
+    cdef public long evictions
+    cdef public long evicted_nodes
+    # stop the search once the most visited child of the root is decided, or once the
+    # KL divergence of the root visits between two checks is below early_stop_kl
+    cdef public bint early_stop
+    cdef public float early_stop_kl
+    cdef public np.ndarray _kl_counts
+    cdef public int _kl_next
+    # number of simulations run and saved by stopping early and the time
+    # in seconds taken by the last search
+    cdef public int num_sims
+    cdef public int saved_sims
+    cdef public double search_time
+    # limits of the search of a move: the simulation budget, the time at which the
+    # search stops (0 for no time limit) and the maximum number of nodes in the tree
+    cdef public int _sims_budget
+    cdef public double _search_start
+    cdef public double _deadline
+    cdef public int search_max_nodes
+    # Gumbel root search: the children of the root with the highest Gumbel noise plus
+    # log prior are visited with sequential halving over the simulation budget
+    cdef public bint use_gumbel
+    cdef public int gumbel_considered
+    cdef public int _gumbel_sims
+    # Gumbel noise, visits at the start of the search and the sequential halving
+    # visit schedule of the root children, sampled at the first root selection
+    cdef public np.ndarray _gumbel
+    cdef public np.ndarray _gumbel_base
+    cdef public np.ndarray _gumbel_schedule
+    # instrumentation of the search, see PROFILE_STATS, only collected if profile is set
+    cdef public bint profile
+    cdef public long prof_sims
+    cdef public long prof_nodes
+    cdef public long prof_clones
+    cdef public long prof_actions
+    cdef public long prof_win_states
+    cdef public long prof_legal_actions
+    cdef public long prof_observations
+    cdef public double prof_select_time
+    cdef public double prof_expand_time
+    cdef public double prof_observation_time
+    cdef public double prof_backup_time
+    cdef public np.ndarray depth_histogram
+
+    # transposition table mapping position hashes to the node ids of expanded nodes and their positions
+    cdef public bint use_transpositions
+    cdef public dict _transpositions
+    cdef public object _leaf_hash
+    cdef public long tt_lookups
+    cdef public long tt_hits
+
+    # state that the leaves are selected on for games that support undo_action, it is
+    # a clone of _state_source at _state_turns with _state_depth actions played on it
+    cdef object _state
+    cdef object _state_source
+    cdef int _state_turns
+    cdef int _state_depth
+
+    # path of edge ids from the root to the current edge, when multiple
+    # leaves are selected their paths are stored one after the other
+    cdef public np.ndarray _path
+    cdef public int _path_len
+
+    # leaves selected by find_leaves that are waiting for their results
+    cdef public np.ndarray _pending_edges
+    cdef public np.ndarray _pending_path_ends
+    cdef public int _num_pending
+
+    # edge pool
+    cdef public int _num_edges
+    cdef public int _edge_capacity
+    cdef public np.ndarray _n
+    cdef public np.ndarray _q
+    cdef public np.ndarray _p
+    cdef public np.ndarray _a
+    # number of pending evaluations of leaves below an edge
+    cdef public np.ndarray _virtual_loss
+    # id of the node the edge leads to, -1 until the edge is selected
+    cdef public np.ndarray _child
+
+    # node pool
+    cdef public int _size
+    cdef public int _capacity
+    cdef public np.ndarray _v
+    cdef public np.ndarray _player
+    cdef public np.ndarray _terminal
+    # game-theoretic result of a node as a win state bit mask (0 if unknown),
+    # terminal nodes are always proven, other nodes only with the solver enabled
+    cdef public np.ndarray _proven
+    # block of edges of the legal moves of a node
+    cdef public np.ndarray _first_child
+    cdef public np.ndarray _num_children
+    # sum of the priors of all visited edges of a node
+    cdef public np.ndarray _seen_policy
+    # id of the node that holds the shared statistics of a position, this is
+    # the node itself unless it was reached by a transposition of another node
+    cdef public np.ndarray _link
+    # id of the edge leading to a node, which holds the visits of the node
+    cdef public np.ndarray _edge
 
     def __init__(self, args: dotdict):
         self.root_noise_frac = args.root_noise_frac
@@ -137,134 +314,1110 @@ cdef class MCTS:
         self.fpu_reduction = args.fpu_reduction
         self.cpuct = args.cpuct
         self._num_players = args._num_players
-        self._root = Node(-1, self._num_players)
-        self._curnode = self._root
-        self._path = []
-        self.depth = 0
-        self.max_depth = 0
-        self._discount_max_depth = 0
+        self.use_transpositions = args.get('mctsTranspositions', False)
+        self.use_solver = args.get('mctsSolver', False)
+        self.widening_constant = args.get('mctsWideningConstant') or 0
+        self.widening_exponent = args.get('mctsWideningExponent', 0.5)
+        self.max_nodes = args.get('mctsMaxNodes') or 0
+        self.evictions = 0
+        self.evicted_nodes = 0
+        self.early_stop = args.get('mctsEarlyStop', False)
+        self.early_stop_kl = args.get('mctsEarlyStopKL') or 0
+        self.num_sims = 0
+        self.saved_sims = 0
+        self.search_time = 0
+        self._sims_budget = 0
+        self._search_start = 0
+        self._deadline = 0
+        self.search_max_nodes = args.get('mctsSearchMaxNodes') or 0
+        self.use_gumbel = args.get('mctsGumbel', False)
+        self.gumbel_considered = args.get('mctsGumbelConsidered', 16)
+        self._gumbel_sims = 0
+        self.profile = args.get('mctsProfile', False)
+        self.reset_profile()
+        self._edge_capacity = _INITIAL_CAPACITY
+        self._n = np.zeros(self._edge_capacity, dtype=np.int32)
+        self._q = np.zeros(self._edge_capacity, dtype=np.float32)
+        self._p = np.zeros(self._edge_capacity, dtype=np.float32)
+        self._a = np.zeros(self._edge_capacity, dtype=np.int32)
+        self._virtual_loss = np.zeros(self._edge_capacity, dtype=np.int32)
+        self._child = np.zeros(self._edge_capacity, dtype=np.int32)
+        self._capacity = _INITIAL_CAPACITY
+        self._v = np.zeros(self._capacity, dtype=np.float32)
+        self._player = np.zeros(self._capacity, dtype=np.int32)
+        self._terminal = np.zeros(self._capacity, dtype=np.uint32)
+        self._proven = np.zeros(self._capacity, dtype=np.uint32)
+        self._first_child = np.zeros(self._capacity, dtype=np.int32)
+        self._num_children = np.zeros(self._capacity, dtype=np.int32)
+        self._seen_policy = np.zeros(self._capacity, dtype=np.float64)
+        self._link = np.zeros(self._capacity, dtype=np.int32)
+        self._edge = np.zeros(self._capacity, dtype=np.int32)
+        self._path = np.zeros(64, dtype=np.int32)
+        self._pending_edges = np.zeros(0, dtype=np.int32)
+        self._pending_path_ends = np.zeros(0, dtype=np.int32)
+        self.reset()
 
     def __repr__(self):
         return 'MCTS(root_noise_frac={}, root_temp={}, min_discount={}, fpu_reduction={}, cpuct={}, _num_players={}, ' \
-               '_root={}, _curnode={}, _path={}, depth={}, max_depth={})' \
+               '_curedge={}, _size={}, _capacity={}, _num_edges={}, depth={}, max_depth={})' \
             .format(self.root_noise_frac, self.root_temp, self.min_discount,
-                    self.fpu_reduction,self.cpuct, self._num_players, self._root,
-                    self._curnode, self._path, self.depth, self.max_depth)
+                    self.fpu_reduction, self.cpuct, self._num_players, self._curedge,
+                    self._size, self._capacity, self._num_edges, self.depth, self.max_depth)
 
     cpdef void reset(self):
-        self._root = Node(-1, self._num_players)
-        self._curnode = self._root
-        self._path = []
+        self._num_edges = 0
+        self._size = 0
+        self._alloc_edges(1)
+        self._a[ROOT] = -1
+        self._new_node(ROOT)
+        self._curedge = ROOT
+        self._path_len = 0
+        self._num_pending = 0
         self.depth = 0
         self.max_depth = 0
         self._discount_max_depth = 0
+        self._transpositions = {}
+        self.tt_lookups = 0
+        self.tt_hits = 0
+        self._kl_counts = None
+        self._kl_next = 0
+        self._gumbel = None
+        self._release_state()
+
+    cdef int _alloc_edges(self, int count):
+        """Allocate a contiguous block of `count` new edges from the pool,
+        growing the pool if needed. Returns the id of the first edge.
+        """
+        cdef int first = self._num_edges
+        cdef int size = self._num_edges + count
+        cdef int capacity = self._edge_capacity
+
+        if size > capacity:
+            while capacity < size:
+                capacity *= 2
+            self._n = _resized(self._n, self._num_edges, capacity)
+            self._q = _resized(self._q, self._num_edges, capacity)
+            self._p = _resized(self._p, self._num_edges, capacity)
+            self._a = _resized(self._a, self._num_edges, capacity)
+            self._virtual_loss = _resized(self._virtual_loss, self._num_edges, capacity)
+            self._child = _resized(self._child, self._num_edges, capacity)
+            self._edge_capacity = capacity
+
+        self._n[first:size] = 0
+        self._q[first:size] = 0
+        self._p[first:size] = 0
+        self._virtual_loss[first:size] = 0
+        self._child[first:size] = -1
+        self._num_edges = size
+        return first
+
+    cdef int _new_node(self, int edge):
+        """Create the node that the edge leads to, growing the node pool
+        if needed. Returns the id of the new node.
+        """
+        cdef int node = self._size
+        cdef int capacity = self._capacity
+
+        if node == capacity:
+            capacity *= 2
+            self._v = _resized(self._v, self._size, capacity)
+            self._player = _resized(self._player, self._size, capacity)
+            self._terminal = _resized(self._terminal, self._size, capacity)
+            self._proven = _resized(self._proven, self._size, capacity)
+            self._first_child = _resized(self._first_child, self._size, capacity)
+            self._num_children = _resized(self._num_children, self._size, capacity)
+            self._seen_policy = _resized(self._seen_policy, self._size, capacity)
+            self._link = _resized(self._link, self._size, capacity)
+            self._edge = _resized(self._edge, self._size, capacity)
+            self._capacity = capacity
+
+        self._v[node] = 0
+        self._player[node] = 0
+        self._terminal[node] = 0
+        self._proven[node] = 0
+        self._first_child[node] = -1
+        self._num_children[node] = 0
+        self._seen_policy[node] = 0
+        self._link[node] = node
+        self._edge[node] = edge
+        self._child[edge] = node
+        self._size += 1
+        if self.profile:
+            self.prof_nodes += 1
+        return node
+
+    cdef void _add_children(self, int node, np.ndarray actions):
+        """Add an edge for each of the legal actions of the node, in random order."""
+        cdef int num_children = len(actions)
+        cdef int first = self._alloc_edges(num_children)
+        cdef np.ndarray children = self._a[first:first + num_children]
+        children[:] = actions
+        # shuffle children
+        np.random.shuffle(children)
+        self._first_child[node] = first
+        self._num_children[node] = num_children
+
+    cdef void _push_path(self, int edge):
+        if self._path_len == len(self._path):
+            self._path = _resized(self._path, self._path_len, 2 * self._path_len)
+        self._path[self._path_len] = edge
+        self._path_len += 1
+
+    cdef int _num_widened(self, int edge, int node):
+        """Get the number of children of the node that are searched,
+        the children are sorted by their prior if widening is enabled.
+        """
+        cdef int num_children = self._num_children[node]
+        if self.widening_constant <= 0:
+            return num_children
+        cdef int n = self._n[edge] + self._virtual_loss[edge]
+        cdef int k = <int>ceil(self.widening_constant * pow(n, self.widening_exponent))
+        return min(max(k, 1), num_children)
+
+    cdef int _best_child(self, int edge, int node):
+        """Select the best edge of the node reached by the given edge."""
+        cdef int first = self._first_child[node]
+        cdef int last = first + self._num_widened(edge, node)
+        cdef int parent_n = self._n[edge] + self._virtual_loss[edge]
+        cdef double seen_policy = self._seen_policy[self._link[node]]
+        # without the solver, only terminal children are proven and they are never skipped
+        cdef unsigned int non_loss_mask = (1u << self._player[node]) | (1u << self._game_players) \
+            if self.use_solver else 0
+        cdef int child = _select_child(
+            first, last, self._v[node], seen_policy, parent_n, self._n, self._q, self._p,
+            self._virtual_loss, self._child, self._proven, non_loss_mask, self.fpu_reduction, self.cpuct
+        )
+        if child == -1 and last < first + self._num_children[node]:
+            # all of the widened children are proven losses, try the other children
+            child = _select_child(
+                last, first + self._num_children[node], self._v[node], seen_policy, parent_n,
+                self._n, self._q, self._p, self._virtual_loss, self._child, self._proven, non_loss_mask,
+                self.fpu_reduction, self.cpuct
+            )
+        return child
+
+    cdef void _sort_children(self, int first, int last):
+        """Sort the unvisited edges in the block [first, last) by their prior,
+        highest first, so that progressive widening searches the best ones.
+        """
+        cdef np.ndarray order = np.argsort(-self._p[first:last], kind='stable')
+        self._p[first:last] = self._p[first:last][order]
+        self._a[first:last] = self._a[first:last][order]
+
+    cdef unsigned int _solve(self, int node):
+        """Get the proven result of a node from the results of its children, the
+        player to move at the node picks the child with the best result for them.
+        Returns 0 if the result of the node can't be proven yet.
+        """
+        cdef unsigned int[:] proven = self._proven
+        cdef int[:] link = self._link
+        cdef int[:] child = self._child
+        cdef int first = self._first_child[node]
+        cdef int player = self._player[node]
+        cdef unsigned int best_mask = 0
+        cdef float best_value = -1
+        cdef float value
+        cdef unsigned int mask
+        cdef int c
+
+        for c in range(first, first + self._num_children[node]):
+            mask = proven[link[child[c]]] if child[c] != -1 else 0
+            if not mask:
+                # the node can still be proven if any child is a win
+                best_value = 2
+                continue
+            value = _mask_value(mask, player, self._game_players)
+            if value >= 1:
+                return mask
+            if value > best_value:
+                best_value = value
+                best_mask = mask
+
+        return best_mask if best_value <= 1 else 0
 
-    # def __reduce__(self):
-    #   return rebuild_mcts, (self._root._players, self.cpuct, self._root, self._curnode, self._path)
+    def root_result(self) -> Optional[np.ndarray]:
+        """Get the win state of the current root if its game-theoretic
+        result was proven by the search, otherwise None.
+        """
+        if self._proven[ROOT]:
+            return _mask_to_value(self._proven[ROOT], self._win_state_size()).astype(np.uint8)
+
+    cdef Py_ssize_t _win_state_size(self):
+        # the win states have an entry for each player of the game and one for a draw,
+        # the number of players is only known once a leaf was backed up
+        return self._game_players + 1 if self._game_players else self._num_players
 
-    cpdef void search(self, object gs, object nn, int sims, bint add_root_noise, bint add_root_temp):
+    cpdef void search(self, object gs, object nn, int sims, bint add_root_noise, bint add_root_temp,
+                      float time_limit=0):
+        """Search the tree of the current root with sims simulations, evaluating every
+        leaf with nn. If time_limit is given, the search also stops after that many seconds.
+        """
         cdef float[:] v
         cdef float[:] p
+        cdef int num_sims = 0
         self.max_depth = 0
+        self.start_search(sims, time_limit)
 
-        for _ in range(sims):
+        while num_sims < sims and not self.search_done(sims - num_sims):
             leaf = self.find_leaf(gs)
             p, v = nn(leaf.observation())
             self.process_results(leaf, v, p, add_root_noise, add_root_temp)
+            num_sims += 1
+
+        self._end_search(sims, num_sims)
+
+    cpdef void batch_search(self, object gs, object nn, int sims, int batch_size,
+                            bint add_root_noise, bint add_root_temp, float time_limit=0):
+        """Same as search, but up to batch_size leaves are selected from the tree
+        at once using virtual loss and evaluated by nn in a single batch. nn must take
+        a batch of observations and return a batch of policies and values.
+        """
+        cdef float[:, :] v
+        cdef float[:, :] p
+        cdef list leaves
+        cdef int num_sims = 0
+        self.max_depth = 0
+        self.start_search(sims, time_limit)
 
-    cpdef void raw_search(self, object gs, int sims, bint add_root_noise, bint add_root_temp):
+        while num_sims < sims and not self.search_done(sims - num_sims):
+            leaves = self.find_leaves(gs, min(batch_size, sims - num_sims))
+            p, v = nn(np.array([leaf.observation() for leaf in leaves]))
+            self.process_results_batch(gs, v, p, add_root_noise, add_root_temp)
+            num_sims += len(leaves)
+
+        self._end_search(sims, num_sims)
+
+    cpdef void raw_search(self, object gs, int sims, bint add_root_noise, bint add_root_temp,
+                          float time_limit=0):
         cdef Py_ssize_t policy_size = gs.action_size()
         cdef float[:] v = np.zeros(gs.num_players() + 1, dtype=np.float32)  #np.full((value_size,), 1 / value_size, dtype=np.float32)
         cdef float[:] p = np.full(policy_size, 1, dtype=np.float32)
+        cdef int num_sims = 0
         self.max_depth = 0
+        self.start_search(sims, time_limit)
 
-        for _ in range(sims):
+        while num_sims < sims and not self.search_done(sims - num_sims):
             leaf = self.find_leaf(gs)
             self.process_results(leaf, v, p, add_root_noise, add_root_temp)
+            num_sims += 1
+
+        self._end_search(sims, num_sims)
+
+    cpdef void start_search(self, int sims, float time_limit=0):
+        """Start the search of a move at the current root with a budget of sims
+        simulations, and of time_limit seconds if given. The search methods call
+        this themselves, it only has to be called before selecting leaves with
+        find_leaf or find_leaves directly.
+        """
+        self._sims_budget = sims
+        self._search_start = perf_counter()
+        self._deadline = self._search_start + time_limit if time_limit > 0 else 0
+        self._gumbel_sims = 0
+        self._gumbel = None
+
+    cdef void _end_search(self, int sims, int num_sims):
+        self.num_sims = num_sims
+        # the budget of a timed search is only an upper bound, so nothing is saved
+        self.saved_sims = sims - num_sims if not self._deadline else 0
+        self.search_time = perf_counter() - self._search_start
+
+    cpdef bint search_done(self, int remaining):
+        """Whether the search of the current root can stop with `remaining`
+        simulations left. This is the case if the result of the root is proven, the
+        time limit of the search is up, the tree reached search_max_nodes nodes or,
+        with early stopping enabled, if no other child of the root can overtake the
+        most visited child in the remaining simulations. If early_stop_kl is set,
+        the search also stops once the visit distribution of the root children
+        stays within that KL divergence between two checks.
+        """
+        if self._proven[ROOT]:
+            return True
+        # the limits only apply once a child of the root was visited, so there is a move to play
+        if self._n[ROOT] < 2:
+            return False
+        if self.search_max_nodes and self._size >= self.search_max_nodes:
+            return True
+
+        cdef double now, elapsed
+        cdef int sims_done
+        if self._deadline:
+            now = perf_counter()
+            if now >= self._deadline:
+                return True
+            # only the simulations that fit into the remaining time can still change the best move
+            sims_done = self._sims_budget - remaining
+            elapsed = now - self._search_start
+            if sims_done > 0 and elapsed > 0:
+                remaining = min(remaining, <int>(sims_done * (self._deadline - now) / elapsed) + 1)
+
+        # the move chosen by the Gumbel root search doesn't depend on the visits alone
+        if not self.early_stop or self.use_gumbel or self._first_child[ROOT] == -1:
+            return False
+
+        cdef int[:] n = self._n
+        cdef int first = self._first_child[ROOT]
+        cdef int best = 0
+        cdef int second = 0
+        cdef int c
+        for c in range(first, first + self._num_children[ROOT]):
+            if n[c] > best:
+                second = best
+                best = n[c]
+            elif n[c] > second:
+                second = n[c]
+
+        if best - second > remaining:
+            return True
+        return self.early_stop_kl > 0 and self._visits_stable()
+
+    cdef bint _visits_stable(self):
+        """Compare the visit distribution of the root children to the one of the
+        last check, if at least _KL_CHECK_INTERVAL visits were made since then.
+        """
+        if self._n[ROOT] < self._kl_next:
+            return False
+
+        cdef int first = self._first_child[ROOT]
+        cdef np.ndarray counts = self._n[first:first + self._num_children[ROOT]].astype(np.float64)
+        cdef np.ndarray old, new
+        cdef bint stable = False
+        if self._kl_counts is not None and np.sum(self._kl_counts) > 0:
+            old = self._kl_counts / np.sum(self._kl_counts)
+            new = counts / np.sum(counts)
+            # visits only increase, so new is never 0 where old is positive
+            visited = old > 0
+            stable = np.sum(old[visited] * np.log(old[visited] / new[visited])) < self.early_stop_kl
+
+        self._kl_counts = counts
+        self._kl_next = self._n[ROOT] + _KL_CHECK_INTERVAL
+        return stable
 
     cpdef void update_root(self, object gs, int a):
-        if not self._root._children:
-            self._root.add_children(gs.valid_moves(), self._num_players)
+        if self._first_child[ROOT] == -1:
+            self._add_children(ROOT, _legal_actions(gs))
 
-        cdef Node c
-        for c in self._root._children:
-            if c.a == a:
-                self._root = c
+        cdef int[:] actions = self._a
+        cdef int first = self._first_child[ROOT]
+        cdef int c
+        for c in range(first, first + self._num_children[ROOT]):
+            if actions[c] == a:
+                self._kl_counts = None
+                self._kl_next = 0
+                self._gumbel = None
+                self._release_state()
+                self._compact(c)
+                if self.max_nodes:
+                    self.prune(self.max_nodes)
                 return
 
-        raise ValueError(f'Invalid action encountered while updating root: {c.a}')
+        raise ValueError(f'Invalid action encountered while updating root: {a}')
+
+    cdef void _compact(self, int new_root_edge):
+        """Move the subtree below `new_root_edge` to the front of the pools with
+        the edge as the new root edge, releasing all other nodes and edges back
+        to the pools. Edge blocks keep their relative order, so the tree is
+        unchanged apart from the ids.
+        """
+        if self._child[new_root_edge] == -1:
+            self._new_node(new_root_edge)
+
+        cdef int[:] child = self._child
+        cdef int[:] first_child = self._first_child
+        cdef int[:] num_children = self._num_children
+        cdef int new_root = child[new_root_edge]
+        cdef list stack = [new_root]
+        cdef list nodes = []
+        cdef list block_starts = []
+        cdef list block_sizes = []
+        cdef set visited = set()
+        cdef int node, c, first
+
+        while stack:
+            node = stack.pop()
+            first = first_child[node]
+            # blocks can be shared by transpositions
+            if first == -1 or first in visited:
+                continue
+            visited.add(first)
+            block_starts.append(first)
+            block_sizes.append(num_children[node])
+            for c in range(first, first + num_children[node]):
+                if child[c] != -1:
+                    nodes.append(child[c])
+                    stack.append(child[c])
+
+        cdef np.ndarray old_starts = np.array(block_starts, dtype=np.int32)
+        cdef np.ndarray sizes = np.array(block_sizes, dtype=np.int32)
+        cdef np.ndarray sort_idx = np.argsort(old_starts)
+        old_starts = old_starts[sort_idx]
+        sizes = sizes[sort_idx]
+        cdef np.ndarray new_starts = 1 + np.cumsum(sizes) - sizes
+        cdef np.ndarray edge_order = np.empty(1 + np.sum(sizes), dtype=np.int64)
+        edge_order[0] = new_root_edge
+        cdef Py_ssize_t i
+        for i in range(len(old_starts)):
+            edge_order[new_starts[i]:new_starts[i] + sizes[i]] = np.arange(
+                old_starts[i], old_starts[i] + sizes[i]
+            )
+        cdef np.ndarray node_order = np.empty(1 + len(nodes), dtype=np.int64)
+        node_order[0] = new_root
+        node_order[1:] = np.sort(nodes)
+        cdef np.ndarray new_ids = np.full(self._size, -1, dtype=np.int32)
+        new_ids[node_order] = np.arange(len(node_order), dtype=np.int32)
+        cdef np.ndarray new_edge_ids = np.full(self._num_edges, -1, dtype=np.int32)
+        new_edge_ids[edge_order] = np.arange(len(edge_order), dtype=np.int32)
+
+        cdef int num_edges = len(edge_order)
+        self._n[:num_edges] = self._n[edge_order]
+        self._q[:num_edges] = self._q[edge_order]
+        self._p[:num_edges] = self._p[edge_order]
+        self._a[:num_edges] = self._a[edge_order]
+        self._virtual_loss[:num_edges] = self._virtual_loss[edge_order]
+        cdef np.ndarray old_child = self._child[edge_order]
+        cdef np.ndarray created = old_child != -1
+        old_child[created] = new_ids[old_child[created]]
+        self._child[:num_edges] = old_child
+
+        cdef np.ndarray links
+        if self.use_transpositions:
+            links = self._compact_links(node_order, new_ids)
+        else:
+            links = np.arange(len(node_order), dtype=np.int32)
+
+        cdef int size = len(node_order)
+        self._v[:size] = self._v[node_order]
+        self._player[:size] = self._player[node_order]
+        self._terminal[:size] = self._terminal[node_order]
+        self._proven[:size] = self._proven[node_order]
+        self._num_children[:size] = self._num_children[node_order]
+        self._seen_policy[:size] = self._seen_policy[node_order]
+        self._edge[:size] = new_edge_ids[self._edge[node_order]]
+
+        cdef np.ndarray old_first = self._first_child[node_order]
+        cdef np.ndarray expanded = old_first != -1
+        old_first[expanded] = new_starts[np.searchsorted(old_starts, old_first[expanded])]
+        self._first_child[:size] = old_first
+        self._link[:size] = links
+        self._size = size
+        self._num_edges = num_edges
+
+    cdef np.ndarray _compact_links(self, np.ndarray order, np.ndarray new_ids):
+        """Get the new links of the nodes given by order before they are moved
+        to the front of the pool, and update the transposition table to the new
+        node ids. If the node holding the shared statistics of a position is
+        released, the first kept node linked to it takes its place.
+        """
+        cdef np.ndarray old_links = self._link[order]
+        cdef np.ndarray links = new_ids[old_links]
+        cdef dict replacements = {}
+        cdef int node, old_link
+
+        for node in np.flatnonzero(links == -1):
+            old_link = old_links[node]
+            if old_link not in replacements:
+                replacements[old_link] = node
+                self._seen_policy[order[node]] = self._seen_policy[old_link]
+                # the position may have been proven through another path
+                self._proven[order[node]] = self._proven[old_link]
+            links[node] = replacements[old_link]
+
+        cdef dict transpositions = {}
+        for h, (node, state) in self._transpositions.items():
+            node = new_ids[node] if new_ids[node] != -1 else replacements.get(node, -1)
+            if node != -1:
+                transpositions[h] = (node, state)
+        self._transpositions = transpositions
+        return links
+
+    cpdef int prune(self, int max_nodes):
+        """Evict the subtrees of the least visited nodes below the root until the
+        tree has at most max_nodes nodes. The statistics of an evicted node are
+        kept, only its children are released back to the pools and the node is
+        expanded again the next time it is visited. The children of proven nodes are
+        kept. Must not be called while leaves selected by find_leaves are pending.
+        Returns the number of evicted nodes.
+        """
+        cdef int size = self._size
+        cdef int[:] edge = self._edge
+        cdef int[:] link = self._link
+        cdef int[:] first_child = self._first_child
+        cdef int[:] owner
+        cdef int[:] subtree_size
+        cdef np.ndarray links, candidates
+        cdef int node, first, excess, freed
+
+        while self._size > max_nodes:
+            # nodes are always created after the node owning their edge, so the
+            # subtree sizes can be summed up in reverse order of the node ids
+            owner = np.zeros(self._num_edges, dtype=np.int32)
+            for node in range(self._size):
+                first = first_child[node]
+                if first != -1 and link[node] == node:
+                    owner[first:first + self._num_children[node]] = node
+            subtree_size = np.ones(self._size, dtype=np.int32)
+            for node in range(self._size - 1, ROOT, -1):
+                subtree_size[owner[edge[node]]] += subtree_size[node]
+
+            # the children of transposed positions are shared, so they are kept, and
+            # so are the children of proven nodes, they hold the move that proves the result
+            links = self._link[:self._size]
+            candidates = np.flatnonzero(
+                (np.asarray(subtree_size) > 1) & (links == np.arange(self._size))
+                & (np.bincount(links, minlength=self._size) == 1) & (self._proven[:self._size] == 0)
+            )
+            candidates = candidates[candidates != ROOT]
+            if len(candidates) == 0:
+                break
+            candidates = candidates[np.argsort(self._n[self._edge[candidates]], kind='stable')]
+
+            excess = self._size - max_nodes
+            freed = 0
+            for node in candidates:
+                if freed >= excess:
+                    break
+                freed += subtree_size[node] - 1
+                first_child[node] = -1
+                self._num_children[node] = 0
+                self._seen_policy[node] = 0
+            self._compact(ROOT)
+
+        cdef int evicted = size - self._size
+        if evicted:
+            self.evictions += 1
+            self.evicted_nodes += evicted
+        return evicted
+
+    def to_bytes(self, int max_depth=0, int min_visits=0) -> bytes:
+        """Get a compact binary snapshot of the tree, a header followed by the used
+        part of every edge and node array, which can be restored with from_bytes.
+        If max_depth is given, the children of the nodes max_depth moves below the
+        root are left out, and if min_visits is given, the children of nodes with
+        fewer visits are left out. Such nodes keep their statistics and are expanded
+        again when they are visited, like the nodes evicted by prune, but the children
+        of transposed positions and proven nodes are always kept. Must not be called
+        while leaves selected by find_leaves are pending.
+        """
+        if not max_depth and not min_visits:
+            return self._pack()
+
+        cdef MCTS tree = MCTS.__new__(MCTS)
+        tree.use_transpositions = self.use_transpositions
+        tree._num_players = self._num_players
+        tree.from_bytes(self._pack())
+        tree._cut(max_depth, min_visits)
+        return tree._pack()
+
+    def from_bytes(self, bytes data) -> None:
+        """Replace the tree with a snapshot created by to_bytes. The settings of the
+        search are the ones of this instance, so it should be created with the same
+        args as the tree of the snapshot, a ValueError is raised if the number of
+        players of the snapshot differs. The transposition table isn't part of the
+        snapshot, so positions of the restored tree aren't found as transpositions.
+        """
+        cdef np.ndarray header = np.frombuffer(data, dtype=np.int64, count=_SNAPSHOT_HEADER_SIZE)
+        if header[0] != _SNAPSHOT_MAGIC or header[1] != _SNAPSHOT_VERSION:
+            raise ValueError('Invalid MCTS snapshot, it must be created by MCTS.to_bytes')
+        if header[4] != self._num_players:
+            raise ValueError(
+                f'The MCTS snapshot was created with _num_players={header[4]}, '
+                f'but this tree has _num_players={self._num_players}'
+            )
+
+        cdef int num_edges = header[2]
+        cdef int size = header[3]
+        cdef Py_ssize_t offset = header.nbytes
+        cdef np.ndarray arr
+        self._edge_capacity = max(num_edges, _INITIAL_CAPACITY)
+        self._capacity = max(size, _INITIAL_CAPACITY)
+        for (name, dtype), count, capacity in (
+            *((array, num_edges, self._edge_capacity) for array in _SNAPSHOT_EDGE_ARRAYS),
+            *((array, size, self._capacity) for array in _SNAPSHOT_NODE_ARRAYS)
+        ):
+            arr = np.zeros(capacity, dtype=dtype)
+            arr[:count] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += arr[:count].nbytes
+            setattr(self, name, arr)
+
+        self._virtual_loss = np.zeros(self._edge_capacity, dtype=np.int32)
+        if self._path is None:
+            self._path = np.zeros(64, dtype=np.int32)
+            self._pending_edges = np.zeros(0, dtype=np.int32)
+            self._pending_path_ends = np.zeros(0, dtype=np.int32)
+        self._num_edges = num_edges
+        self._size = size
+        self._discount_max_depth = header[5]
+        self._game_players = header[6]
+        self._curedge = ROOT
+        self._path_len = 0
+        self._num_pending = 0
+        self.depth = 0
+        self.max_depth = 0
+        self._transpositions = {}
+        self._kl_counts = None
+        self._kl_next = 0
+        self._gumbel = None
+        self._release_state()
+
+    cdef bytes _pack(self):
+        cdef np.ndarray header = np.array([
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, self._num_edges, self._size,
+            self._num_players, self._discount_max_depth, self._game_players
+        ], dtype=np.int64)
+        return b''.join([header.tobytes()] + [
+            getattr(self, name)[:self._num_edges].tobytes() for name, _ in _SNAPSHOT_EDGE_ARRAYS
+        ] + [
+            getattr(self, name)[:self._size].tobytes() for name, _ in _SNAPSHOT_NODE_ARRAYS
+        ])
+
+    cdef void _cut(self, int max_depth, int min_visits):
+        """Release the children of the nodes below max_depth or with fewer than
+        min_visits visits, the other nodes are kept as they are.
+        """
+        cdef int[:] edge = self._edge
+        cdef int[:] link = self._link
+        cdef int[:] first_child = self._first_child
+        cdef int[:] n = self._n
+        cdef int[:] owner = np.zeros(self._num_edges, dtype=np.int32)
+        cdef int[:] depth = np.zeros(self._size, dtype=np.int32)
+        cdef np.ndarray links = self._link[:self._size]
+        cdef np.ndarray shared = np.bincount(links, minlength=self._size) > 1
+        cdef int node, first
+
+        for node in range(self._size):
+            first = first_child[node]
+            if first != -1 and link[node] == node:
+                owner[first:first + self._num_children[node]] = node
+        # nodes are always created after the node owning their edge
+        for node in range(1, self._size):
+            depth[node] = depth[owner[edge[node]]] + 1
+            if link[node] != node or shared[node] or self._proven[node]:
+                continue
+            if max_depth and depth[node] >= max_depth or min_visits and n[edge[node]] < min_visits:
+                first_child[node] = -1
+                self._num_children[node] = 0
+                self._seen_policy[node] = 0
+        self._compact(ROOT)
 
     cpdef void _add_root_noise(self):
-        cdef int num_valid_moves = len(self._root._children)
+        cdef int num_valid_moves = self._num_children[ROOT]
         cdef float[:] noise = np.array(np.random.dirichlet(
             [NOISE_ALPHA_RATIO / num_valid_moves] * num_valid_moves
         ), dtype=np.float32)
-        cdef Node c
-        cdef float n
+        cdef float[:] p = self._p
+        cdef int first = self._first_child[ROOT]
+        cdef int i
 
-        for n, c in zip(noise, self._root._children):
-            c.p = c.p * (1 - self.root_noise_frac) + self.root_noise_frac * n
+        for i in range(num_valid_moves):
+            p[first + i] = p[first + i] * (1 - self.root_noise_frac) + self.root_noise_frac * noise[i]
 
-    cpdef object find_leaf(self, object gs):
+    cdef int _descend(self, object leaf):
+        """Walk down the tree from the root by selecting the best edge at each node
+        until an unvisited or proven node is reached, playing the actions on leaf.
+        Nodes are created for the edges on the way the first time they are selected.
+        The path is appended to the current path, returns the id of the edge reached.
+        """
+        cdef int edge = ROOT
+        cdef int node = ROOT
+        cdef int path_start = self._path_len
+        cdef int child
         self.depth = 0
-        self._curnode = self._root
-        cdef object leaf = gs.clone()
 
-        while self._curnode.n > 0 and not self._curnode.e.any():
-            self._path.append(self._curnode)
-            self._curnode = self._curnode.best_child(self.fpu_reduction, self.cpuct)
-            leaf.play_action(self._curnode.a)
+        while True:
+            if self._n[edge] == 0 and not self._transpose(node, leaf, path_start):
+                break
+            if self._proven[self._link[node]]:
+                break
+            if self._first_child[node] == -1:
+                # the children of the node were evicted by prune
+                break
+            if node == ROOT and self.use_gumbel:
+                child = self._gumbel_child()
+            else:
+                child = self._best_child(edge, node)
+            if child == -1:
+                # all children were proven to be lost through transpositions
+                # of the node, so the node itself is proven
+                self._proven[node] = self._solve(node)
+                self._proven[self._link[node]] = self._proven[node]
+                break
+            self._push_path(edge)
+            edge = child
+            node = self._child[edge]
+            if node == -1:
+                node = self._new_node(edge)
+            leaf.play_action(self._a[edge])
             self.depth += 1
 
         if self.depth > self.max_depth:
             self.max_depth = self.depth
             self._discount_max_depth = self.depth
 
-        if self._curnode.n == 0:
-            self._curnode.player = leaf.player
-            self._curnode.e = leaf.win_state()
-            self._curnode.add_children(leaf.valid_moves(), self._num_players)
+        return edge
+
+    cdef bint _transpose(self, int node, object leaf, int path_start):
+        """Look up the position of the unvisited node in the transposition table.
+        If the position was already expanded and evaluated through another path,
+        the node is linked to it and shares its edges and value, so that the
+        search can continue below it without evaluating the position again.
+        The position of the other node is compared as well, so that positions
+        whose hashes collide aren't linked. Returns True if the node is linked
+        to another node.
+        """
+        if not self.use_transpositions:
+            return False
+        if self._link[node] != node:
+            return True
+
+        self._leaf_hash = hash(leaf)
+        self.tt_lookups += 1
+        cdef tuple entry = self._transpositions.get(self._leaf_hash)
+        if entry is None:
+            return False
+        cdef int other = entry[0]
+        if self._n[self._edge[other]] == 0 or self._first_child[other] == -1 or not leaf == entry[1]:
+            return False
+
+        # don't create cycles if a position repeats along the current path
+        cdef int[:] link = self._link
+        cdef int[:] child = self._child
+        cdef int[:] path = self._path
+        cdef int i
+        for i in range(path_start, self._path_len):
+            if link[child[path[i]]] == other:
+                return False
 
+        link[node] = other
+        self._first_child[node] = self._first_child[other]
+        self._num_children[node] = self._num_children[other]
+        self._v[node] = self._v[other]
+        self._player[node] = self._player[other]
+        self.tt_hits += 1
+        return True
+
+    cdef void _expand(self, int edge, object leaf):
+        cdef int node = self._child[edge]
+        if self._link[node] != node or self._first_child[node] != -1:
+            return
+        if self._n[edge] == 0:
+            self._player[node] = leaf.player
+            self._terminal[node] = _win_state_mask(leaf.win_state())
+            self._proven[node] = self._terminal[node]
+            if self.use_transpositions and not self._terminal[node] and self._leaf_hash not in self._transpositions:
+                self._transpositions[self._leaf_hash] = (node, leaf.clone())
+            if self.profile:
+                self.prof_win_states += 1
+        # nodes that were visited before are expanded again after their children were evicted
+        if not self._proven[node]:
+            self._add_children(node, _legal_actions(leaf))
+            if self.profile:
+                self.prof_legal_actions += 1
+
+    cdef object _search_state(self, object gs):
+        """Get a state at the root of the tree to select a leaf on. Games that support
+        undo_action are kept in one state per tree, which is taken back to the root by
+        undoing the actions of the last selection, other games are cloned every time.
+        """
+        if gs is not self._state_source or gs.turns != self._state_turns:
+            self._state_source = gs
+            self._state_turns = gs.turns
+            self._state = gs.clone() if _supports_undo(gs) else None
+            self._state_depth = 0
+            if self.profile and self._state is not None:
+                self.prof_clones += 1
+        if self._state is None:
+            if self.profile:
+                self.prof_clones += 1
+            return gs.clone()
+
+        while self._state_depth:
+            self._state.undo_action()
+            self._state_depth -= 1
+        return self._state
+
+    cdef void _release_state(self):
+        """Drop the state of the selection when the root changes."""
+        self._state = None
+        self._state_source = None
+
+    cpdef object find_leaf(self, object gs):
+        """Select a leaf of the tree for evaluation, returns the state of the leaf.
+        For games that support undo_action the state is reused by the tree, so it is
+        only valid until the next selection and mustn't be modified.
+        """
+        cdef double start = perf_counter() if self.profile else 0
+        self._path_len = 0
+        cdef object leaf = self._search_state(gs)
+        self._curedge = self._descend(leaf)
+        self._state_depth = self.depth
+        if self.profile:
+            start = self._profile_selection(start)
+        self._expand(self._curedge, leaf)
+        if self.profile:
+            self.prof_expand_time += perf_counter() - start
         return leaf
 
+    cpdef list find_leaves(self, object gs, int k):
+        """Select up to k distinct leaves from the tree for evaluation in one batch.
+        Virtual loss is applied along the path of every selected leaf, so that the
+        following selections are steered towards other parts of the tree. Fewer than
+        k leaves are returned if a leaf would be selected twice. The results have to
+        be given to process_results_batch in the order of the returned leaves.
+        No leaves are returned if the result of the root is already proven.
+        """
+        cdef list leaves = []
+        self._select_leaves(gs, k, leaves, None, 0)
+        return leaves
+
+    cpdef int select_leaves(self, object gs, int k, np.ndarray batch=None, Py_ssize_t row=0):
+        """Same as find_leaves, but the observations of the leaves are written to the
+        rows of batch starting at row instead of returning the leaves, unless batch is
+        None. Returns the number of leaves selected. The leaves don't have to outlive
+        the selection, so games that support undo_action aren't cloned for them.
+        """
+        return self._select_leaves(gs, k, None, batch, row)
+
+    cdef int _select_leaves(self, object gs, int k, list leaves, np.ndarray batch, Py_ssize_t row):
+        cdef object leaf
+        cdef int edge, start
+        cdef double start_time = 0
+
+        if len(self._pending_edges) < k:
+            self._pending_edges = np.zeros(k, dtype=np.int32)
+            self._pending_path_ends = np.zeros(k, dtype=np.int32)
+        self._path_len = 0
+        self._num_pending = 0
+
+        while self._num_pending < k and not self._proven[ROOT]:
+            start = self._path_len
+            if self.profile:
+                start_time = perf_counter()
+            if leaves is not None:
+                leaf = gs.clone()
+                if self.profile:
+                    self.prof_clones += 1
+            else:
+                leaf = self._search_state(gs)
+            edge = self._descend(leaf)
+            if leaves is None:
+                self._state_depth = self.depth
+            if self.profile:
+                start_time = self._profile_selection(start_time)
+            if self._n[edge] == 0 and self._virtual_loss[edge] > 0:
+                # the leaf is already waiting for its evaluation
+                self._path_len = start
+                break
+
+            self._expand(edge, leaf)
+            if self.profile:
+                self.prof_expand_time += perf_counter() - start_time
+            self._apply_virtual_loss(edge, start, self._path_len, 1)
+            self._pending_edges[self._num_pending] = edge
+            self._pending_path_ends[self._num_pending] = self._path_len
+            if leaves is not None:
+                leaves.append(leaf)
+            elif batch is not None:
+                if self.profile:
+                    start_time = perf_counter()
+                batch[row + self._num_pending] = leaf.observation()
+                if self.profile:
+                    self.prof_observation_time += perf_counter() - start_time
+                    self.prof_observations += 1
+            self._num_pending += 1
+
+        return self._num_pending
+
+    cpdef tuple take_pending(self):
+        """Detach the leaves selected by the last call to find_leaves, so that more
+        leaves can be selected while they are evaluated, e.g. by another thread.
+        Their virtual loss stays in the tree until the returned batch is given
+        to process_pending together with the results of the leaves.
+        """
+        cdef tuple pending = (
+            self._pending_edges[:self._num_pending].copy(),
+            self._pending_path_ends[:self._num_pending].copy(),
+            self._path[:self._path_len].copy()
+        )
+        self._num_pending = 0
+        self._path_len = 0
+        return pending
+
+    cpdef void process_pending(self, tuple pending, object gs, float[:, :] values, float[:, :] pis,
+                               bint add_root_noise, bint add_root_temp):
+        """Same as process_results_batch for a batch of leaves detached with take_pending."""
+        self._restore_pending(pending)
+        self.process_results_batch(gs, values, pis, add_root_noise, add_root_temp)
+
+    cpdef void discard_pending(self, tuple pending):
+        """Remove the virtual loss of a batch of leaves detached with take_pending
+        without backing up any results, e.g. if their evaluation failed.
+        """
+        self._restore_pending(pending)
+        cdef int start = 0
+        cdef int i, end
+        for i in range(self._num_pending):
+            end = self._pending_path_ends[i]
+            self._apply_virtual_loss(self._pending_edges[i], start, end, -1)
+            start = end
+        self._num_pending = 0
+        self._path_len = 0
+        self._curedge = ROOT
+
+    cdef void _restore_pending(self, tuple pending):
+        cdef np.ndarray edges = pending[0]
+        cdef np.ndarray path = pending[2]
+        cdef int num_pending = len(edges)
+
+        if len(self._pending_edges) < num_pending:
+            self._pending_edges = np.zeros(num_pending, dtype=np.int32)
+            self._pending_path_ends = np.zeros(num_pending, dtype=np.int32)
+        if len(self._path) < len(path):
+            self._path = _resized(self._path, 0, len(path))
+        self._pending_edges[:num_pending] = edges
+        self._pending_path_ends[:num_pending] = pending[1]
+        self._path[:len(path)] = path
+        self._num_pending = num_pending
+        self._path_len = len(path)
+
+    cdef double _profile_selection(self, double start):
+        """Record the selection of a leaf that started at the given time, returns the current time."""
+        cdef double now = perf_counter()
+        self.prof_select_time += now - start
+        self.prof_actions += self.depth
+        self.depth_histogram[min(self.depth, PROFILE_MAX_DEPTH - 1)] += 1
+        return now
+
+    cpdef void reset_profile(self):
+        self.prof_sims = 0
+        self.prof_nodes = 0
+        self.prof_clones = 0
+        self.prof_actions = 0
+        self.prof_win_states = 0
+        self.prof_legal_actions = 0
+        self.prof_observations = 0
+        self.prof_select_time = 0
+        self.prof_expand_time = 0
+        self.prof_observation_time = 0
+        self.prof_backup_time = 0
+        self.depth_histogram = np.zeros(PROFILE_MAX_DEPTH, dtype=np.int64)
+
+    def profile_stats(self) -> dict:
+        """Get the statistics collected since the last reset_profile if profile is set,
+        see PROFILE_STATS, and the histogram of the selection depth as depth_histogram.
+        """
+        return dict(
+            sims=self.prof_sims, nodes=self.prof_nodes, clones=self.prof_clones, actions=self.prof_actions,
+            win_states=self.prof_win_states, legal_actions=self.prof_legal_actions,
+            observations=self.prof_observations, select_time=self.prof_select_time,
+            expand_time=self.prof_expand_time, observation_time=self.prof_observation_time,
+            backup_time=self.prof_backup_time, depth_histogram=self.depth_histogram.copy()
+        )
+
+    cdef void _apply_virtual_loss(self, int edge, int path_start, int path_end, int amount):
+        cdef int[:] virtual_loss = self._virtual_loss
+        cdef int[:] path = self._path
+        cdef int i
+
+        virtual_loss[edge] += amount
+        for i in range(path_start, path_end):
+            virtual_loss[path[i]] += amount
+
     cpdef void process_results(self, object gs, float[:] value, float[:] pi, bint add_root_noise, bint add_root_temp):
-        cdef float[:] valids
-        cdef Node c
-        
-        if self._curnode.e.any():
-            value = np.array(self._curnode.e, dtype=np.float32)
-        else:
-            # reconstruct valid moves based on children of current node
-            # instead of recalculating with gs.valid_moves() -> expensive
-            valids = np.zeros(gs.action_size(), dtype=np.float32)
-            for c in self._curnode._children:
-                valids[c.a] = 1
+        cdef double start = perf_counter() if self.profile else 0
+        self._backup(self._curedge, 0, self._path_len, value, pi, gs.num_players(), add_root_noise, add_root_temp)
+        self._path_len = 0
+        self._curedge = ROOT
+        if self.profile:
+            self.prof_backup_time += perf_counter() - start
+            self.prof_sims += 1
+
+    cpdef void process_results_batch(self, object gs, float[:, :] values, float[:, :] pis,
+                                      bint add_root_noise, bint add_root_temp):
+        """Back up the results of the leaves selected by the last call to find_leaves,
+        where row i of values and pis belongs to the i-th leaf.
+        """
+        cdef Py_ssize_t num_players = gs.num_players()
+        cdef int start = 0
+        cdef int i, edge, end
+        cdef double start_time = perf_counter() if self.profile else 0
+
+        for i in range(self._num_pending):
+            edge = self._pending_edges[i]
+            end = self._pending_path_ends[i]
+            self._apply_virtual_loss(edge, start, end, -1)
+            self._backup(edge, start, end, values[i], pis[i], num_players, add_root_noise, add_root_temp)
+            start = end
+
+        if self.profile:
+            self.prof_backup_time += perf_counter() - start_time
+            self.prof_sims += self._num_pending
+        self._num_pending = 0
+        self._path_len = 0
+        self._curedge = ROOT
 
-            # mask invalid moves and rescale
-            pi *= np.array(valids, dtype=np.float32)
-            pi /= np.sum(pi)
+    cdef void _backup(self, int edge, int path_start, int path_end, float[:] value, float[:] pi,
+                      Py_ssize_t num_players, bint add_root_noise, bint add_root_temp):
+        """Set the policy of the evaluated leaf node and back up its value along
+        the path of edges stored in self._path[path_start:path_end].
+        """
+        cdef int[:] actions = self._a
+        cdef float[:] p = self._p
+        cdef int[:] child = self._child
+        cdef int node = child[edge]
+        cdef int first = self._first_child[node]
+        cdef int last = first + self._num_children[node]
+        cdef int c
+        cdef double pi_sum = 0
+        cdef unsigned int[:] proven = self._proven
+        cdef int[:] link = self._link
+        cdef bint solving = self.use_solver and proven[link[node]]
+        cdef unsigned int mask
+        self._game_players = num_players
+
+        if proven[link[node]]:
+            value = _mask_to_value(proven[link[node]], num_players + 1)
+        else:
+            # mask invalid moves and rescale, only the children
+            # of the current node have to be looked at for this
+            for c in range(first, last):
+                p[c] = pi[actions[c]]
+                pi_sum += p[c]
+            for c in range(first, last):
+                p[c] = p[c] / pi_sum if pi_sum > 0 else 1. / (last - first)
 
-            if self._curnode == self._root:
+            if node == ROOT:
                 # add root temperature
                 if add_root_temp:
-                    pi = np.asarray(pi) ** (1.0 / self.root_temp)
+                    pi_sum = 0
+                    for c in range(first, last):
+                        p[c] = p[c] ** (1.0 / self.root_temp)
+                        pi_sum += p[c]
                     # re-normalize
-                    pi /= np.sum(pi)
+                    for c in range(first, last):
+                        p[c] /= pi_sum
 
-                self._curnode.update_policy(pi)
-                if add_root_noise:
+                if self.use_gumbel:
+                    # the Gumbel noise replaces the dirichlet noise and needs the value of the root
+                    self._v[ROOT] = self._get_value(value, self._player[ROOT], num_players)
+                elif add_root_noise:
                     self._add_root_noise()
-            else:
-                self._curnode.update_policy(pi)
 
-        cdef Py_ssize_t num_players = gs.num_players()
-        cdef Node parent
+            if self.widening_constant > 0:
+                self._sort_children(first, last)
+
+        cdef int[:] n = self._n
+        cdef float[:] q = self._q
+        cdef int[:] player = self._player
+        cdef double[:] seen_policy = self._seen_policy
+        cdef int[:] path = self._path
+        cdef int parent_edge, parent
         cdef float v
         cdef float discount
         cdef int i = 0
-        while self._path:
-            parent = self._path.pop()
-            v = self._get_value(value, parent.player, num_players)
+        while path_end > path_start:
+            path_end -= 1
+            parent_edge = path[path_end]
+            parent = child[parent_edge]
+            v = self._get_value(value, player[parent], num_players)
 
             # apply discount only to current node's Q value
             discount = (self.min_discount ** (i / self._discount_max_depth))
@@ -279,14 +1432,26 @@ cdef class MCTS:
             # scale value to the range [-1, 1]
             # v = 2 * v * discount - 1
 
-            self._curnode.q = (self._curnode.q * self._curnode.n + v * discount) / (self._curnode.n + 1)
-            if self._curnode.n == 0:
-                self._curnode.v = self._get_value(value, self._curnode.player, num_players)  # * 2 - 1
-            self._curnode.n += 1
-            self._curnode = parent
+            q[edge] = (q[edge] * n[edge] + v * discount) / (n[edge] + 1)
+            if n[edge] == 0:
+                if link[node] == node:
+                    self._v[node] = self._get_value(value, player[node], num_players)  # * 2 - 1
+                seen_policy[link[parent]] += p[edge]
+            n[edge] += 1
+            edge = parent_edge
+            node = parent
             i += 1
 
-        self._root.n += 1
+            # propagate proven results up the path until a node can't be proven
+            if solving:
+                mask = self._solve(node)
+                if mask:
+                    proven[node] = mask
+                    proven[link[node]] = mask
+                else:
+                    solving = False
+
+        n[ROOT] += 1
 
     cpdef float _get_value(self, float[:] value, Py_ssize_t player, Py_ssize_t num_players):
         if value.size > num_players:
@@ -295,14 +1460,32 @@ cdef class MCTS:
             return value[player]
 
     cpdef int[:] counts(self, object gs):
-        cdef int[:] counts = np.zeros(gs.action_size(), dtype=np.int32)
-        cdef Node c
+        cdef np.ndarray counts = np.zeros(gs.action_size(), dtype=np.int32)
+        cdef int first = self._first_child[ROOT]
+        cdef int last = first + self._num_children[ROOT]
 
-        for c in self._root._children:
-            counts[c.a] = c.n
-        return np.asarray(counts)
+        if first == -1:
+            return counts
+
+        counts[self._a[first:last]] = self._n[first:last]
+        if self.use_solver:
+            children = self._child[first:last]
+            proven = np.zeros(last - first, dtype=np.uint32)
+            proven[children != -1] = self._proven[self._link[children[children != -1]]]
+            # only the children that achieve the proven result of the root are counted,
+            # unless none of them was visited below this root
+            keep = proven == self._proven[ROOT] if self._proven[ROOT] else np.zeros(last - first, dtype=bool)
+            if not np.any(self._n[first:last][keep]):
+                # children that are proven to be lost are not played,
+                # unless no other child was visited yet
+                keep = ~self._lost_children()
+            if np.any(self._n[first:last][keep]):
+                counts[self._a[first:last][~keep]] = 0
+        return counts
 
     cpdef int best_action(self, object gs):
+        if self.use_gumbel and self._gumbel is not None and not self._proven[ROOT]:
+            return self._a[self._first_child[ROOT] + self._gumbel_best()]
         return np.argmax(self.counts(gs))
 
     cpdef np.ndarray probs(self, object gs, float temp=1.0):
@@ -310,6 +1493,9 @@ cdef class MCTS:
         cdef np.ndarray[dtype=np.float32_t, ndim=1] probs
         cdef Py_ssize_t best_action
 
+        if self.use_gumbel and self._gumbel is not None and not self._proven[ROOT]:
+            return self._improved_policy(gs, temp)
+
         if temp == 0:
             best_action = np.argmax(counts)
             probs = np.zeros_like(counts)
@@ -326,19 +1512,283 @@ cdef class MCTS:
             probs[best_action] = 1
             return probs
 
+    cdef np.ndarray _lost_children(self):
+        """Get which children of the root are proven to be lost by the solver."""
+        cdef int first = self._first_child[ROOT]
+        cdef np.ndarray children = self._child[first:first + self._num_children[ROOT]]
+        cdef np.ndarray proven = np.zeros(len(children), dtype=np.uint32)
+        proven[children != -1] = self._proven[self._link[children[children != -1]]]
+        return (proven != 0) & (proven & ((1 << self._player[ROOT]) | (1 << self._game_players)) == 0)
+
+    cdef np.ndarray _sigma_q(self):
+        """Get the monotonically transformed completed Q values of the root children.
+        Unvisited children are completed with a mix of the value of the root and the
+        prior weighted Q values of the visited children, then the Q values are
+        rescaled to [0, 1] and scaled by the number of visits of the most visited child.
+        """
+        cdef int first = self._first_child[ROOT]
+        cdef int last = first + self._num_children[ROOT]
+        cdef np.ndarray n = self._n[first:last]
+        cdef np.ndarray q = self._q[first:last].astype(np.float64)
+        cdef np.ndarray p = self._p[first:last].astype(np.float64)
+        cdef np.ndarray visited = n > 0
+        cdef long sum_n = np.sum(n)
+        cdef double v_mix = self._v[ROOT]
+        cdef double p_visited = np.sum(p[visited])
+
+        if sum_n > 0 and p_visited > 0:
+            v_mix = (v_mix + sum_n * np.sum(p[visited] * q[visited]) / p_visited) / (1 + sum_n)
+        q = np.where(visited, q, v_mix)
+        q = (q - np.min(q)) / max(np.max(q) - np.min(q), 1e-8)
+        return (_GUMBEL_C_VISIT + np.max(n)) * _GUMBEL_C_SCALE * q
+
+    cdef np.ndarray _logits(self):
+        cdef int first = self._first_child[ROOT]
+        return np.log(np.maximum(self._p[first:first + self._num_children[ROOT]].astype(np.float64), 1e-30))
+
+    cdef int _gumbel_child(self):
+        """Select the child of the root to visit in the Gumbel root search. The child
+        must have the number of visits given by the sequential halving schedule,
+        and out of those the one with the highest Gumbel noise plus log prior plus
+        transformed Q value is chosen. PUCT is used once the schedule is exhausted.
+        """
+        cdef int first = self._first_child[ROOT]
+        cdef int num_children = self._num_children[ROOT]
+        if self._gumbel is None:
+            self._gumbel = np.random.gumbel(size=num_children)
+            self._gumbel_base = self._n[first:first + num_children].copy()
+            self._gumbel_schedule = _considered_visits(
+                min(self.gumbel_considered, num_children), self._sims_budget
+            )
+        if self._gumbel_sims >= len(self._gumbel_schedule):
+            return self._best_child(ROOT, ROOT)
+
+        cdef np.ndarray visits = self._n[first:first + num_children] + \
+            self._virtual_loss[first:first + num_children] - self._gumbel_base
+        cdef np.ndarray score = self._gumbel + self._logits() + self._sigma_q()
+        score[visits != self._gumbel_schedule[self._gumbel_sims]] = -np.inf
+        if self.use_solver:
+            score[self._lost_children()] = -np.inf
+        self._gumbel_sims += 1
+        if np.all(np.isinf(score)):
+            return self._best_child(ROOT, ROOT)
+        return first + np.argmax(score)
+
+    cdef int _gumbel_best(self):
+        """Get the index of the root child chosen by the Gumbel root search, which is
+        the child with the highest score out of the most visited children of the search.
+        """
+        cdef int first = self._first_child[ROOT]
+        cdef int num_children = self._num_children[ROOT]
+        cdef np.ndarray visits = self._n[first:first + num_children] - self._gumbel_base
+        cdef np.ndarray score = self._gumbel + self._logits() + self._sigma_q()
+        if self.use_solver:
+            visits[self._lost_children()] = -1
+        score[visits != np.max(visits)] = -np.inf
+        return np.argmax(score)
+
+    cdef np.ndarray _improved_policy(self, object gs, float temp):
+        """Get the improved policy of the Gumbel root search, the softmax of the log
+        priors plus the transformed completed Q values of the root children.
+        """
+        cdef int first = self._first_child[ROOT]
+        cdef int num_children = self._num_children[ROOT]
+        cdef np.ndarray probs = np.zeros(gs.action_size(), dtype=np.float32)
+        cdef np.ndarray logits
+
+        if temp == 0:
+            probs[self._a[first + self._gumbel_best()]] = 1
+            return probs
+
+        logits = (self._logits() + self._sigma_q()) / temp
+        if self.use_solver and not np.all(self._lost_children()):
+            logits[self._lost_children()] = -np.inf
+        with np.errstate(under='ignore'):
+            logits = np.exp(logits - np.max(logits))
+        probs[self._a[first:first + num_children]] = logits / np.sum(logits)
+        return probs
+
     cpdef float value(self, bint average=False):
         """Get the value of the current root node in the range [0, 1]
         by looking at the max value of child nodes (or averaging them).
         """
         cdef float value = 0
-        cdef Node c
-        
+        cdef int[:] n = self._n
+        cdef float[:] q = self._q
+        cdef int first = self._first_child[ROOT]
+        cdef int num_children = self._num_children[ROOT]
+        cdef int c
+
+        if first == -1:
+            return value
+        if self._proven[ROOT]:
+            return _mask_value(self._proven[ROOT], self._player[ROOT], self._game_players)
+
         if average:
-            value = sum([c.q for c in self._root._children if c.n > 0]) / len(self._root._children)
-        
+            for c in range(first, first + num_children):
+                if n[c] > 0:
+                    value += q[c]
+            value /= num_children
+
         else:
-            for c in self._root._children:
-                if c.q > value and c.n > 0:
-                    value = c.q
-            
+            for c in range(first, first + num_children):
+                if q[c] > value and n[c] > 0:
+                    value = q[c]
+
         return value
+
+    def transposition_stats(self) -> dict:
+        """Get the number of lookups and hits of the transposition table, every
+        hit is a node that shares the children of an already expanded position.
+        """
+        return dict(
+            lookups=self.tt_lookups, hits=self.tt_hits,
+            hit_rate=self.tt_hits / <double>self.tt_lookups if self.tt_lookups else 0,
+            size=len(self._transpositions)
+        )
+
+    def tree_stats(self) -> dict:
+        """Get the number of nodes and edges in the tree, the memory used by the
+        pools in bytes and the number of evictions and evicted nodes of prune.
+        """
+        cdef np.ndarray arr
+        cdef long memory = 0
+        for arr in (self._n, self._q, self._p, self._a, self._virtual_loss, self._child, self._v,
+                    self._player, self._terminal, self._proven, self._first_child, self._num_children,
+                    self._seen_policy, self._link, self._edge):
+            memory += arr.nbytes
+        return dict(
+            nodes=self._size, edges=self._num_edges, memory=memory,
+            evictions=self.evictions, evicted_nodes=self.evicted_nodes
+        )
+
+    def children(self, int edge=ROOT) -> list:
+        """Get the ids of the edges of the node that the given edge leads to."""
+        cdef int node = self._child[edge]
+        if node == -1 or self._first_child[node] == -1:
+            return []
+        cdef int first = self._first_child[node]
+        return list(range(first, first + self._num_children[node]))
+
+    def node_stats(self, int edge=ROOT) -> dict:
+        """Get the statistics of an edge and the node it leads to as a dictionary."""
+        cdef int node = self._child[edge]
+        return dict(
+            a=int(self._a[edge]), q=float(self._q[edge]), n=int(self._n[edge]), p=float(self._p[edge]),
+            v=float(self._v[node]) if node != -1 else 0., player=int(self._player[node]) if node != -1 else 0,
+            e=_mask_to_value(self._terminal[node] if node != -1 else 0, self._win_state_size()).astype(np.uint8),
+            proven=_mask_to_value(
+                self._proven[self._link[node]] if node != -1 else 0, self._win_state_size()
+            ).astype(np.uint8)
+        )
+
+
+cdef class BatchedMCTS:
+    """The search trees of all game slots of a self play agent. The leaves of all
+    slots are selected and written to the batch in one call, and the results of
+    the whole batch are backed up in one call, so that the agent doesn't loop over
+    its games in Python for every batch. Slot i uses the rows starting at
+    i * leaves_per_tree of the batch, the policy and the value arrays.
+    """
+    cdef public list trees
+    cdef public int leaves_per_tree
+    # number of leaves selected into the current batch and number of simulations
+    # of the current move for each slot, slots whose search is done are skipped
+    cdef public np.ndarray num_leaves
+    cdef public np.ndarray num_sims
+    cdef public np.ndarray searching
+    cdef public int sims
+
+    def __init__(self, args: dotdict, int num_trees, int leaves_per_tree=1):
+        self.trees = [MCTS(args) for _ in range(num_trees)]
+        self.leaves_per_tree = leaves_per_tree
+        self.num_leaves = np.zeros(num_trees, dtype=np.int32)
+        self.num_sims = np.zeros(num_trees, dtype=np.int32)
+        self.searching = np.ones(num_trees, dtype=np.uint8)
+        self.sims = 0
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __getitem__(self, int index) -> MCTS:
+        return self.trees[index]
+
+    def __setitem__(self, int index, MCTS tree):
+        self.trees[index] = tree
+
+    cpdef void start_search(self, int sims):
+        """Start the search of the current move of every slot with a budget of sims simulations."""
+        cdef MCTS tree
+        self.sims = sims
+        self.num_sims[:] = 0
+        self.searching[:] = 1
+        for tree in self.trees:
+            tree.start_search(sims)
+
+    cpdef bint update_searching(self, Py_ssize_t first=0, Py_ssize_t last=-1):
+        """Check which slots still have to be searched for the current move, a slot is done
+        once it used its budget of simulations or its search can stop early. Returns False
+        if the search of all slots is done. Only the slots from first up to last are
+        checked if last isn't -1.
+        """
+        cdef int[:] num_sims = self.num_sims
+        cdef unsigned char[:] searching = self.searching
+        cdef bint any_searching = False
+        cdef MCTS tree
+        cdef Py_ssize_t i
+        if last == -1:
+            last = len(self.trees)
+        for i in range(first, last):
+            tree = self.trees[i]
+            searching[i] = num_sims[i] < self.sims and not tree.search_done(self.sims - num_sims[i])
+            any_searching |= searching[i]
+        return any_searching
+
+    cpdef void find_leaves(self, list games, np.ndarray batch=None, Py_ssize_t first=0, Py_ssize_t last=-1):
+        """Select the leaves of every searching slot from its tree, where games holds the
+        current state of each slot. The observations of the leaves are written to the rows
+        of batch unless it is None. If last isn't -1, only the slots from first up to last
+        are searched and the rows of slot first start at the beginning of the batch.
+        """
+        cdef int[:] num_leaves = self.num_leaves
+        cdef int[:] num_sims = self.num_sims
+        cdef unsigned char[:] searching = self.searching
+        cdef MCTS tree
+        cdef Py_ssize_t i
+        if last == -1:
+            last = len(self.trees)
+
+        for i in range(first, last):
+            if not searching[i]:
+                num_leaves[i] = 0
+                continue
+            tree = self.trees[i]
+            # the last leaves of a move are limited to the simulations left in its budget
+            num_leaves[i] = tree.select_leaves(
+                games[i], min(self.leaves_per_tree, self.sims - num_sims[i]), batch,
+                (i - first) * self.leaves_per_tree
+            )
+            num_sims[i] += num_leaves[i]
+
+    cpdef void process_results(self, list games, float[:, :] values, float[:, :] pis,
+                               bint add_root_noise, bint add_root_temp, Py_ssize_t first=0, Py_ssize_t last=-1):
+        """Back up the results of the leaves selected by the last call to find_leaves
+        for every searching slot, reading its rows of values and pis. The slots from
+        first up to last are backed up, with the same rows as in find_leaves.
+        """
+        cdef int[:] num_leaves = self.num_leaves
+        cdef unsigned char[:] searching = self.searching
+        cdef MCTS tree
+        cdef Py_ssize_t i, row
+        if last == -1:
+            last = len(self.trees)
+
+        for i in range(first, last):
+            if not searching[i]:
+                continue
+            tree = self.trees[i]
+            row = (i - first) * self.leaves_per_tree
+            tree.process_results_batch(
+                games[i], values[row:row + num_leaves[i]], pis[row:row + num_leaves[i]],
+                add_root_noise, add_root_temp
+            )
@@ -2,7 +2,8 @@ from alphazero.NNetArchitecture import ResNet, FullyConnected
 from alphazero.pytorch_classification.utils import Bar, AverageMeter
 from alphazero.Game import GameState
 from alphazero.utils import dotdict
-from threading import Event
+from threading import Event, Lock
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 from typing import Tuple, Optional
 
@@ -13,9 +14,68 @@ import warnings
 import torch
 import pickle
 import time
+import sys
 import os
 
 
+class EvaluationCache:
+    """
+    A least recently used cache of network evaluations with a memory budget.
+    Entries are keyed by the version of the model that evaluated the observation
+    together with the bytes of the observation itself.
+    """
+    # approximate overhead of the arrays, key tuple and dict entry of a cached evaluation
+    _ENTRY_OVERHEAD = 384
+
+    def __init__(self, max_memory: int):
+        """
+        max_memory: the memory budget of the cached evaluations in bytes
+        """
+        self.max_memory = max_memory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._max_entries = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Tuple[int, bytes]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple[int, bytes], pi: np.ndarray, v: np.ndarray):
+        with self._lock:
+            if self._max_entries is None:
+                entry_size = pi.nbytes + v.nbytes + sys.getsizeof(key[1]) + self._ENTRY_OVERHEAD
+                self._max_entries = self.max_memory // entry_size
+            if self._max_entries == 0:
+                return
+            self._entries[key] = (pi, v)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits, misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0,
+            size=len(self._entries)
+        )
+
+
 class BaseWrapper(ABC):
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -67,6 +127,18 @@ class BaseWrapper(ABC):
         """
         pass
 
+    def predict_batch(self, boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Input:
+            boards: a batch of boards as a numpy array
+
+        Returns:
+            pi: a batch of policy vectors, one for each board
+            v: a batch of values, one for each board
+        """
+        pi, v = zip(*[self.predict(board) for board in boards])
+        return np.array(pi, dtype=np.float32), np.array(v, dtype=np.float32)
+
     @abstractmethod
     def save_checkpoint(self, folder, filename):
         """
@@ -108,6 +180,11 @@ class NNetWrapper(BaseWrapper):
         self.eta = 0
         self.__loaded = False
 
+        # incremented every time the weights of the network change
+        self.model_version = 0
+        cache_size = args.get('nnet_cache_mb', 0)
+        self.cache = EvaluationCache(cache_size * 2 ** 20) if cache_size else None
+
     def _load_nnet(self, args):
         if args.nnet_type == 'resnet':
             self.nnet = ResNet(self.game_cls, args)
@@ -120,6 +197,15 @@ class NNetWrapper(BaseWrapper):
     def loaded(self):
         return self.__loaded
 
+    def _new_model_version(self):
+        self.model_version += 1
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _cache_key(self, board: np.ndarray) -> Tuple[int, bytes]:
+        # the observation itself is part of the key, so that boards with the same hash aren't mixed up
+        return self.model_version, board.tobytes()
+
     def train(self, batches, train_steps):
         self.total_steps = train_steps
         self.nnet.train()
@@ -201,6 +287,7 @@ class NNetWrapper(BaseWrapper):
         bar.update()  # TODO: division by zero when train steps is too small (0?)
         bar.finish()
         print()
+        self._new_model_version()
 
         return pi_losses.avg, v_losses.avg
 
@@ -208,6 +295,16 @@ class NNetWrapper(BaseWrapper):
         """
         board: np array with board
         """
+        if self.cache is not None:
+            key = self._cache_key(board)
+            cached = self.cache.get(key)
+            if cached is None:
+                cached = self._predict(board)
+                self.cache.put(key, *cached)
+            return cached[0].copy(), cached[1].copy()
+        return self._predict(board)
+
+    def _predict(self, board: np.ndarray):
         # timing
         # start = time.time()
 
@@ -222,7 +319,38 @@ class NNetWrapper(BaseWrapper):
             # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
             return torch.exp(pi).data.cpu().numpy()[0], torch.exp(v).data.cpu().numpy()[0]
 
+    def predict_batch(self, boards: np.ndarray):
+        """
+        boards: np array with a batch of boards
+        """
+        pi, v = self.process(torch.from_numpy(boards))
+        return pi.data.cpu().numpy(), v.data.cpu().numpy()
+
     def process(self, batch: torch.Tensor):
+        if self.cache is None:
+            return self._process(batch)
+
+        boards = batch.cpu().numpy()
+        keys = [self._cache_key(board) for board in boards]
+        cached = [self.cache.get(key) for key in keys]
+        pi = np.empty((len(boards), self.action_size), dtype=np.float32)
+        v = np.empty((len(boards), self.game_cls.num_players() + 1), dtype=np.float32)
+
+        misses = [i for i, entry in enumerate(cached) if entry is None]
+        if misses:
+            new_pi, new_v = self._process(batch[misses])
+            pi[misses] = new_pi.cpu().numpy()
+            v[misses] = new_v.cpu().numpy()
+            for i in misses:
+                self.cache.put(keys[i], pi[i].copy(), v[i].copy())
+
+        for i, entry in enumerate(cached):
+            if entry is not None:
+                pi[i], v[i] = entry
+
+        return torch.from_numpy(pi), torch.from_numpy(v)
+
+    def _process(self, batch: torch.Tensor):
         batch = batch.type(torch.FloatTensor)
         if self.args.cuda:
             batch = batch.cuda()
@@ -256,7 +384,8 @@ class NNetWrapper(BaseWrapper):
         if not os.path.exists(filepath):
             raise FileNotFoundError("No model in path {}".format(filepath))
 
-        checkpoint = torch.load(filepath)
+        # the checkpoint holds the args of the model, which aren't plain tensors
+        checkpoint = torch.load(filepath, weights_only=False)
         args_saved = 'args' in checkpoint
         if use_saved_args and args_saved:
             self.args = checkpoint['args']
@@ -271,6 +400,7 @@ class NNetWrapper(BaseWrapper):
             self.scheduler.load_state_dict(checkpoint['sch_state'])
 
         self.__loaded = True
+        self._new_model_version()
         if args_saved:
             return checkpoint['args']
 
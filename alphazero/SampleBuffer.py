@@ -0,0 +1,91 @@
+from typing import List, Tuple
+
+from torch import multiprocessing as mp
+import numpy as np
+import shutil
+import torch
+import time
+import os
+
+# the directory of the shared memory that the tensors are allocated in
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+class SampleBuffer:
+    """Ring buffers in shared memory that the self play agents write their training samples to,
+    one for each agent. A ring has a slab for the observations, policies and values of
+    capacity samples, and counts the samples that were written by the agent and consumed
+    by the reader. An agent waits while its ring is full, so the rings have to be read
+    regularly by a single reader while the agents are running.
+    """
+
+    def __init__(self, game_cls, num_writers: int, capacity: int):
+        self.num_writers = num_writers
+        self.capacity = capacity
+        # running out of shared memory crashes the processes that touch it later on instead
+        # of failing here, and the shared memory of docker containers is only 64MB by default
+        sample_size = np.prod(game_cls.observation_size()) + game_cls.action_size() + game_cls.num_players() + 1
+        num_bytes = int(num_writers * capacity * sample_size * torch.zeros(0).element_size())
+        free = shutil.disk_usage(SHARED_MEMORY_DIR).free if os.path.isdir(SHARED_MEMORY_DIR) else None
+        if free is not None and num_bytes > free:
+            raise MemoryError(
+                f'The sample buffer of {num_writers} workers with {capacity} samples each needs '
+                f'{num_bytes / 2 ** 20:.1f}MB of shared memory, but only {free / 2 ** 20:.1f}MB are free in '
+                f'{SHARED_MEMORY_DIR}. Lower sample_buffer_size or increase the shared memory '
+                f'(e.g. with the --shm-size option of docker run).'
+            )
+        self.data = torch.zeros([num_writers, capacity, *game_cls.observation_size()]).share_memory_()
+        self.policy = torch.zeros([num_writers, capacity, game_cls.action_size()]).share_memory_()
+        self.value = torch.zeros([num_writers, capacity, game_cls.num_players() + 1]).share_memory_()
+        # total number of samples written to and consumed from each ring, only ever increased
+        # by the writer and the reader of the ring, the position in the ring is the count modulo capacity
+        self.written = mp.Array('l', num_writers)
+        self.consumed = mp.Array('l', num_writers)
+
+    def write(self, writer: int, data: np.ndarray, policy: np.ndarray, value: np.ndarray,
+              stop_event=None) -> bool:
+        """Write the samples given by the rows of data, policy and value to the ring of
+        the writer, waiting for the reader while the ring is full. Returns False if
+        stop_event was set while waiting, the remaining samples are dropped then.
+        """
+        num_samples = len(data)
+        done = 0
+        while done < num_samples:
+            written = self.written[writer]
+            free = self.capacity - (written - self.consumed[writer])
+            if not free:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                time.sleep(0.01)
+                continue
+
+            start = written % self.capacity
+            count = min(num_samples - done, free, self.capacity - start)
+            self.data[writer, start:start + count] = torch.from_numpy(data[done:done + count])
+            self.policy[writer, start:start + count] = torch.from_numpy(policy[done:done + count])
+            self.value[writer, start:start + count] = torch.from_numpy(value[done:done + count])
+            # the samples are only visible to the reader once they are copied
+            self.written[writer] = written + count
+            done += count
+
+        return True
+
+    def read(self) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """Consume the samples that were written since the last read, returns copies of the
+        data, policy and value of the consecutive samples in each ring as chunks.
+        """
+        chunks = []
+        written = self.written[:]
+        consumed = self.consumed[:]
+        for writer in range(self.num_writers):
+            position = consumed[writer]
+            while position < written[writer]:
+                start = position % self.capacity
+                count = min(written[writer] - position, self.capacity - start)
+                chunks.append(tuple(
+                    tensor[writer, start:start + count].clone() for tensor in (self.data, self.policy, self.value)
+                ))
+                position += count
+            self.consumed[writer] = position
+
+        return chunks
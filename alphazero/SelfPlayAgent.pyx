@@ -1,32 +1,43 @@
 # cython: language_level=3
 
 import torch.multiprocessing as mp
+from queue import Empty
 import numpy as np
 import torch
 import traceback
 import itertools
 import time
 
-from alphazero.MCTS import MCTS
+from alphazero.MCTS import MCTS, BatchedMCTS, PROFILE_STATS, PROFILE_MAX_DEPTH
+from alphazero.utils import RESIGN_CALIBRATION_BINS
 
 
 class SelfPlayAgent(mp.Process):
     def __init__(self, id, game_cls, ready_queue, batch_ready, batch_tensor, policy_tensor,
                  value_tensor, output_queue, result_queue, complete_count, games_played,
-                 stop_event: mp.Event, pause_event: mp.Event(), args, _is_arena=False, _is_warmup=False):
+                 stop_event: mp.Event, pause_event: mp.Event(), args, _is_arena=False, _is_warmup=False,
+                 search_stats=None, resign_threshold=None, sample_buffer=None, control_queue=None):
         super().__init__()
         self.id = id
         self.game_cls = game_cls
         self.ready_queue = ready_queue
         self.batch_ready = batch_ready
         self.batch_tensor = batch_tensor
+        # the game slots of self play can be split into groups that are evaluated separately,
+        # the tensors and ready events are then lists with the ones of each group, see searchSplits
+        self.batch_splits = len(batch_ready) if isinstance(batch_ready, list) else 1
         if _is_arena:
             self.batch_size = policy_tensor.shape[0]
+        elif self.batch_splits > 1:
+            self.batch_size = sum(tensor.shape[0] for tensor in batch_tensor)
         else:
             self.batch_size = self.batch_tensor.shape[0]
         self.policy_tensor = policy_tensor
         self.value_tensor = value_tensor
+        # the batches of the arena are sent through the output queue, the samples of self play
+        # are written to the agent's ring of the shared sample buffer
         self.output_queue = output_queue
+        self.sample_buffer = sample_buffer
         self.result_queue = result_queue
         self.games = []
         self.histories = []
@@ -38,6 +49,72 @@ class SelfPlayAgent(mp.Process):
         self.stop_event = stop_event
         self.pause_event = pause_event
         self.args = args
+        # a persistent agent keeps its games and trees after the games of an iteration were played,
+        # and waits for the settings of the next iteration on its control queue, see waitForIteration
+        self.control_queue = control_queue
+
+        # node budget of all trees of the process and the shared search statistics
+        # of all agents, moves, sims and saved_sims are counted per player index
+        self.max_process_nodes = self.args.get('mctsProcessMaxNodes') or 0
+        self.search_stats = search_stats
+        self.evictions = 0
+        self.evicted_nodes = 0
+        self._reported_evictions = 0
+        self._reported_evicted_nodes = 0
+        # profile statistics of the trees that were already reset
+        self.profile = self.args.get('mctsProfile', False)
+        self.profile_totals = np.zeros(len(PROFILE_STATS))
+        self.depth_histogram = np.zeros(PROFILE_MAX_DEPTH, dtype=np.int64)
+        self._reported_profile = np.zeros(len(PROFILE_STATS))
+        self._reported_depth_histogram = np.zeros(PROFILE_MAX_DEPTH, dtype=np.int64)
+
+        # each game uses a fixed range of rows in the batch tensors
+        # to store the leaves that are selected from its tree
+        self.leaves_per_tree = 1 if _is_arena else max(1, self.args.get('mctsLeavesPerTree', 1))
+        self.num_games = self.batch_size // self.leaves_per_tree
+        # simulations of the current move that were run for each game and the time
+        # spent in its tree, games whose search is done are skipped until the next move
+        self.sims = 0
+        self.num_sims = [0] * self.num_games
+        self.search_time = [0.] * self.num_games
+        self.searching = [True] * self.num_games
+        if not _is_arena:
+            # the trees of self play are searched together by the batched engine
+            self.mcts = BatchedMCTS(self.args, self.num_games, self.leaves_per_tree)
+            self.num_sims = self.mcts.num_sims
+            self.searching = self.mcts.searching
+        # the first and last slot of each group
+        self.split_slots = []
+        if self.batch_splits > 1:
+            first = 0
+            for tensor in batch_tensor:
+                # the rows of a group can't hold a part of the leaves of a game
+                if tensor.shape[0] % self.leaves_per_tree:
+                    raise ValueError(
+                        f'The batch of each group of games must have a multiple of mctsLeavesPerTree '
+                        f'({self.leaves_per_tree}) rows, but has {tensor.shape[0]}, process_batch_size '
+                        f'/ process_batch_splits should be a multiple of mctsLeavesPerTree'
+                    )
+                last = first + tensor.shape[0] // self.leaves_per_tree
+                self.split_slots.append((first, last))
+                first = last
+            assert self.split_slots[-1][1] == self.num_games
+        # the Gumbel root search picks the move itself and targets its improved policy
+        self.gumbel = self.args.get('mctsGumbel', False)
+        # a two player game is resigned once the root value of the player to move was below
+        # the threshold for resignMoves of their moves in a row, the games that are played out
+        # with resignation disabled measure the false positives of the threshold
+        self.resign_threshold = resign_threshold \
+            if not _is_arena and not _is_warmup and game_cls.num_players() == 2 else None
+        self.resign_moves = self.args.get('resignMoves', 3)
+        self.resign_playout_fraction = self.args.get('resignPlayoutFraction', 0.1)
+        self.playout = [None] * self.num_games
+        self.recent_values = [None] * self.num_games
+        self.resign_values = [None] * self.num_games
+        self.resign_turn = [None] * self.num_games
+
+        # the final states of the games are only sent with their results if requested
+        self.result_states = self.args.get('result_states', False)
 
         self._is_arena = _is_arena
         self._is_warmup = _is_warmup
@@ -52,12 +129,14 @@ class SelfPlayAgent(mp.Process):
             self._WARMUP_VALUE = torch.full((value_size,), 1 / value_size).to(policy_tensor.device)
 
         self.fast = False
-        for _ in range(self.batch_size):
+        for _ in range(self.num_games):
             self.games.append(self.game_cls())
             self.histories.append([])
             self.temps.append(self.args.startTemp)
             self.next_reset.append(0)
-            self.mcts.append(self._get_mcts())
+            self._reset_resign(len(self.games) - 1)
+            if _is_arena:
+                self.mcts.append(self._get_mcts())
 
     def _get_mcts(self):
         if self._is_arena:
@@ -65,6 +144,18 @@ class SelfPlayAgent(mp.Process):
         else:
             return MCTS(self.args)
 
+    def _trees(self, index: int) -> tuple:
+        mcts = self.mcts[index]
+        return mcts if self._is_arena else (mcts,)
+
+    def _reset_mcts(self, index: int):
+        for mcts in self._trees(index):
+            self.evictions += mcts.evictions
+            self.evicted_nodes += mcts.evicted_nodes
+            if self.profile:
+                self._add_profile(mcts)
+        self.mcts[index] = self._get_mcts()
+
     def _mcts(self, index: int) -> MCTS:
         mcts = self.mcts[index]
         if self._is_arena:
@@ -79,124 +170,384 @@ class SelfPlayAgent(mp.Process):
     def run(self):
         try:
             np.random.seed()
-            while not self.stop_event.is_set() and self.games_played.value < self.args.gamesPerIteration:
-                self._check_pause()
-                self.fast = np.random.random_sample() < self.args.probFastSim
-                sims = self.args.numFastSims if self.fast else self.args.numMCTSSims \
-                    if not self._is_warmup else self.args.numWarmupSims
-                for _ in range(sims):
-                    if self.stop_event.is_set(): break
+            while True:
+                self.playGames()
+                if self.profile and self.search_stats is not None:
+                    self.reportProfile()
+                with self.complete_count.get_lock():
+                    self.complete_count.value += 1
+                if self.control_queue is None or not self.waitForIteration():
+                    break
+        except Exception:
+            print(traceback.format_exc())
+
+    def playGames(self):
+        """Play moves of the games until gamesPerIteration games were played by all agents."""
+        while not self.stop_event.is_set() and self.games_played.value < self.args.gamesPerIteration:
+            self._check_pause()
+            self.fast = np.random.random_sample() < self.args.probFastSim
+            sims = self.args.numFastSims if self.fast else self.args.numMCTSSims \
+                if not self._is_warmup else self.args.numWarmupSims
+            self.sims = sims
+            self.search_time = [0.] * self.num_games
+            if self._is_arena:
+                self.num_sims = [0] * self.num_games
+                for i in range(self.num_games):
+                    self._mcts(i).start_search(sims)
+            else:
+                self.mcts.start_search(sims)
+            # collisions between the leaves of a tree can leave a batch short, so the
+            # search goes on until every game used its budget or can stop early
+            if self.batch_splits > 1:
+                self.searchSplits()
+            else:
+                while not self.stop_event.is_set() and self.updateSearching():
                     self.generateBatch()
                     if self.stop_event.is_set(): break
                     self.processBatch()
-                if self.stop_event.is_set(): break
-                self.playMoves()
-
-            with self.complete_count.get_lock():
-                self.complete_count.value += 1
-            if not self._is_arena:
-                self.output_queue.close()
-                self.output_queue.join_thread()
-        except Exception:
-            print(traceback.format_exc())
+            if self.stop_event.is_set(): break
+            self.playMoves()
+
+    def waitForIteration(self) -> bool:
+        """Wait for the control message that starts the next iteration of a persistent agent,
+        returns False if the agent was stopped instead. The message holds the arguments of
+        the iteration and the resignation threshold.
+        """
+        while not self.stop_event.is_set():
+            try:
+                message = self.control_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            self.args.update(message.args)
+            if self.resign_threshold is not None:
+                self.resign_threshold = message.resign_threshold
+            return True
+        return False
+
+    def updateSearching(self) -> bool:
+        """Check which games still have to be searched for the current move,
+        returns False if the search of all games is done.
+        """
+        if not self._is_arena:
+            return self.mcts.update_searching()
+        for i in range(self.num_games):
+            self.searching[i] = self.num_sims[i] < self.sims \
+                and not self._mcts(i).search_done(self.sims - self.num_sims[i])
+        return any(self.searching)
 
     def generateBatch(self):
-        if self._is_arena:
-            batch_tensor = [[] for _ in range(self.game_cls.num_players())]
-            self.batch_indices = [[] for _ in range(self.game_cls.num_players())]
+        if not self._is_arena:
+            self._check_pause()
+            start = time.perf_counter()
+            self.mcts.find_leaves(self.games, None if self._is_warmup else self.batch_tensor.numpy())
+            self._add_batch_time(time.perf_counter() - start)
+            if not self._is_warmup:
+                self.ready_queue.put(self.id)
+            return
 
-        for i in range(self.batch_size):
+        batch_tensor = [[] for _ in range(self.game_cls.num_players())]
+        self.batch_indices = [[] for _ in range(self.game_cls.num_players())]
+        for i in range(self.num_games):
             self._check_pause()
-            state = self._mcts(i).find_leaf(self.games[i])
-            if self._is_warmup:
-                self.policy_tensor[i].copy_(self._WARMUP_POLICY)
-                self.value_tensor[i].copy_(self._WARMUP_VALUE)
+            if not self.searching[i]:
                 continue
+            start = time.perf_counter()
+            self.num_sims[i] += 1
+            state = self._mcts(i).find_leaf(self.games[i])
+            self.search_time[i] += time.perf_counter() - start
+            data = torch.from_numpy(state.observation()).view(-1, *state.observation_size())
+            player = self.player_to_index[self.games[i].player]
+            batch_tensor[player].append(data)
+            self.batch_indices[player].append(i)
 
-            data = torch.from_numpy(state.observation())
-            if self._is_arena:
-                data = data.view(-1, *state.observation_size())
-                player = self.player_to_index[self.games[i].player]
-                batch_tensor[player].append(data)
-                self.batch_indices[player].append(i)
-            else:
-                self.batch_tensor[i].copy_(data)
-
-        if self._is_arena:
-            for player in range(self.game_cls.num_players()):
-                player = self.player_to_index[player]
-                data = batch_tensor[player]
-                if data:
-                    batch_tensor[player] = torch.cat(data)
-            self.output_queue.put(batch_tensor)
-            self.batch_indices = list(itertools.chain.from_iterable(self.batch_indices))
-
-        if not self._is_warmup:
-            self.ready_queue.put(self.id)
+        for player in range(self.game_cls.num_players()):
+            player = self.player_to_index[player]
+            data = batch_tensor[player]
+            if data:
+                batch_tensor[player] = torch.cat(data)
+        self.output_queue.put(batch_tensor)
+        self.batch_indices = list(itertools.chain.from_iterable(self.batch_indices))
+        self.ready_queue.put(self.id)
 
     def processBatch(self):
         if not self._is_warmup:
             self.batch_ready.wait()
             self.batch_ready.clear()
 
-        for i in range(self.batch_size):
-            self._check_pause()
-            index = self.batch_indices[i] if self._is_arena else i
-            self._mcts(i).process_results(
-                self.games[i],
-                self.value_tensor[index].data.numpy(),
-                self.policy_tensor[index].data.numpy(),
-                False if self._is_arena else self.args.add_root_noise,
-                False if self._is_arena else self.args.add_root_temp
-            )
+        if self._is_arena:
+            # the rows of the batch are grouped by player, batch_indices holds the game of each row
+            for row, i in enumerate(self.batch_indices):
+                self._check_pause()
+                start = time.perf_counter()
+                self._mcts(i).process_results(
+                    self.games[i],
+                    self.value_tensor[row].data.numpy(),
+                    self.policy_tensor[row].data.numpy(),
+                    False,
+                    False
+                )
+                self.search_time[i] += time.perf_counter() - start
+            return
+
+        if self._is_warmup:
+            self.policy_tensor[:] = self._WARMUP_POLICY
+            self.value_tensor[:] = self._WARMUP_VALUE
+        self._check_pause()
+        start = time.perf_counter()
+        self.mcts.process_results(
+            self.games,
+            self.value_tensor.numpy(),
+            self.policy_tensor.numpy(),
+            self.args.add_root_noise,
+            self.args.add_root_temp
+        )
+        self._add_batch_time(time.perf_counter() - start)
+
+    def searchSplits(self):
+        """Search the current move of the games in the groups of slots, where each group has
+        its own batch tensors and ready event. While the batch of one group is evaluated, the
+        results of the other groups are backed up and their next leaves are selected, so the
+        search of the trees overlaps with the evaluation of the network.
+        """
+        pending = [False] * self.batch_splits
+        while True:
+            any_pending = False
+            for k, (first, last) in enumerate(self.split_slots):
+                if self.stop_event.is_set():
+                    return
+                batch_tensor, policy_tensor, value_tensor = \
+                    self.batch_tensor[k], self.policy_tensor[k], self.value_tensor[k]
+                if pending[k]:
+                    self.batch_ready[k].wait()
+                    self.batch_ready[k].clear()
+                    self._check_pause()
+                    start = time.perf_counter()
+                    self.mcts.process_results(
+                        self.games,
+                        value_tensor.numpy(),
+                        policy_tensor.numpy(),
+                        self.args.add_root_noise,
+                        self.args.add_root_temp,
+                        first,
+                        last
+                    )
+                    self._add_batch_time(time.perf_counter() - start, first, last)
+                    pending[k] = False
+
+                if self.mcts.update_searching(first, last):
+                    self._check_pause()
+                    start = time.perf_counter()
+                    self.mcts.find_leaves(self.games, batch_tensor.numpy(), first, last)
+                    self._add_batch_time(time.perf_counter() - start, first, last)
+                    self.ready_queue.put(self.id * self.batch_splits + k)
+                    pending[k] = any_pending = True
+
+            if not any_pending:
+                return
+
+    def _add_batch_time(self, elapsed: float, first: int = 0, last: int = None):
+        """Divide the time spent in the trees for a batch between the games that were searched."""
+        last = self.num_games if last is None else last
+        num_searching = sum(self.searching[first:last])
+        for i in range(first, last):
+            if self.searching[i]:
+                self.search_time[i] += elapsed / num_searching
 
     def playMoves(self):
-        for i in range(self.batch_size):
+        for i in range(self.num_games):
             self._check_pause()
             self.temps[i] = self.args.temp_scaling_fn(
                 self.temps[i], self.games[i].turns, self.game_cls.max_turns()
             ) if not self._is_arena else self.args.arenaTemp
-            policy = self._mcts(i).probs(self.games[i], self.temps[i])
-            action = np.random.choice(self.games[i].action_size(), p=policy)
+            if self.gumbel:
+                action = self._mcts(i).best_action(self.games[i])
+            else:
+                policy = self._mcts(i).probs(self.games[i], self.temps[i])
+                action = np.random.choice(self.games[i].action_size(), p=policy)
+            if self.search_stats is not None:
+                self._add_search_stats(i)
             if not self.fast and not self._is_arena:
                 self.histories[i].append((
                     self.games[i].clone(),
                     self._mcts(i).probs(self.games[i])
                 ))
 
-            if self._is_arena:
-                [mcts.update_root(self.games[i], action) for mcts in self.mcts[i]]
-            else:
-                self._mcts(i).update_root(self.games[i], action)
-            self.games[i].play_action(action)
-            if self.args.mctsResetThreshold and self.games[i].turns >= self.next_reset[i]:
-                self.mcts[i] = self._get_mcts()
-                self.next_reset[i] = self.games[i].turns + self.args.mctsResetThreshold
+            winstate = self._check_resign(i) if self.resign_threshold is not None else None
+            resigned = winstate is not None
+            if not resigned:
+                if self._is_arena:
+                    [mcts.update_root(self.games[i], action) for mcts in self.mcts[i]]
+                else:
+                    self._mcts(i).update_root(self.games[i], action)
+                self.games[i].play_action(action)
+                if self.args.mctsResetThreshold and self.games[i].turns >= self.next_reset[i]:
+                    self._reset_mcts(i)
+                    self.next_reset[i] = self.games[i].turns + self.args.mctsResetThreshold
+                winstate = self.games[i].win_state()
 
-            winstate = self.games[i].win_state()
             if winstate.any():
-                self.result_queue.put((self.games[i].clone(), winstate, self.id))
+                self.putResult(i, winstate)
                 lock = self.games_played.get_lock()
                 lock.acquire()
                 if self.games_played.value < self.args.gamesPerIteration:
                     self.games_played.value += 1
                     lock.release()
+                    if self.resign_threshold is not None and self.search_stats is not None:
+                        self._add_resign_stats(i, winstate, resigned)
                     if not self._is_arena:
-                        for hist in self.histories[i]:
-                            self._check_pause()
-                            if self.args.symmetricSamples:
-                                data = hist[0].symmetries(hist[1])
-                            else:
-                                data = ((hist[0], hist[1]),)
-
-                            for state, pi in data:
-                                self._check_pause()
-                                self.output_queue.put((
-                                    state.observation(), pi, np.array(winstate, dtype=np.float32)
-                                ))
-                    self.games[i] = self.game_cls()
-                    self.histories[i] = []
-                    self.temps[i] = self.args.startTemp
-                    self.mcts[i] = self._get_mcts()
+                        self.writeSamples(i, winstate)
                 else:
                     lock.release()
+                # games that finish after all games of the iteration were played are
+                # discarded, a persistent agent starts over with them in the next iteration
+                self.games[i] = self.game_cls()
+                self.histories[i] = []
+                self.temps[i] = self.args.startTemp
+                self._reset_mcts(i)
+                self._reset_resign(i)
+
+        self.pruneTrees()
+
+    def putResult(self, index: int, winstate):
+        """Put the result of the finished game on the result queue, see utils.get_game_results."""
+        result = (tuple(np.flatnonzero(winstate).tolist()), self.games[index].turns, self.id)
+        if self.result_states:
+            result += (self.games[index].clone(),)
+        self.result_queue.put(result)
+
+    def writeSamples(self, index: int, winstate):
+        """Write the samples of the finished game to the sample buffer in one go."""
+        samples = []
+        for state, pi in self.histories[index]:
+            self._check_pause()
+            if self.args.symmetricSamples:
+                samples.extend(state.symmetries(pi))
+            else:
+                samples.append((state, pi))
+        if not samples:
+            return
+
+        data = np.array([state.observation() for state, _ in samples], dtype=np.float32)
+        policy = np.array([pi for _, pi in samples], dtype=np.float32)
+        value = np.tile(np.array(winstate, dtype=np.float32), (len(samples), 1))
+        self.sample_buffer.write(self.id, data, policy, value, self.stop_event)
+
+    def _reset_resign(self, index: int):
+        # whether the game is played out is decided at its first move, after the random seed of the process is set
+        self.playout[index] = None
+        self.recent_values[index] = [[] for _ in range(self.game_cls.num_players())]
+        # lowest value of each player over resignMoves moves in a row, see _check_resign
+        self.resign_values[index] = [1.] * self.game_cls.num_players()
+        self.resign_turn[index] = None
+
+    def _check_resign(self, index: int):
+        """Check whether the player to move resigns the game after the search of the move,
+        returns the win state of the resigned game or None if the game goes on.
+        """
+        game = self.games[index]
+        if self.playout[index] is None:
+            self.playout[index] = np.random.random_sample() < self.resign_playout_fraction
+        recent = self.recent_values[index][game.player]
+        recent.append(self._mcts(index).value())
+        if len(recent) < self.resign_moves:
+            return None
+        del recent[:-self.resign_moves]
+
+        value = max(recent)
+        self.resign_values[index][game.player] = min(self.resign_values[index][game.player], value)
+        if value >= self.resign_threshold:
+            return None
+        if self.playout[index]:
+            if self.resign_turn[index] is None:
+                self.resign_turn[index] = game.turns
+            return None
+
+        winstate = np.zeros_like(game.win_state())
+        winstate[1 - game.player] = 1
+        return winstate
+
+    def _add_resign_stats(self, index: int, winstate, resigned: bool):
+        if resigned:
+            with self.search_stats.resigned.get_lock():
+                self.search_stats.resigned.value += 1
+            return
+        if not self.playout[index]:
+            return
+
+        # the game would have been resigned falsely by a player who didn't lose if the
+        # threshold was above the lowest resignation value of that player
+        draw = winstate[-1]
+        value = min(v for p, v in enumerate(self.resign_values[index]) if winstate[p] or draw)
+        with self.search_stats.resign_calibration.get_lock():
+            self.search_stats.resign_calibration[min(int(value * RESIGN_CALIBRATION_BINS), RESIGN_CALIBRATION_BINS)] += 1
+        with self.search_stats.resign_playouts.get_lock():
+            self.search_stats.resign_playouts.value += 1
+        if self.resign_turn[index] is not None:
+            with self.search_stats.resign_would_resign.get_lock():
+                self.search_stats.resign_would_resign.value += 1
+            with self.search_stats.resign_playout_moves.get_lock():
+                self.search_stats.resign_playout_moves.value += self.games[index].turns - self.resign_turn[index]
+
+    def _add_search_stats(self, index: int):
+        player = self.player_to_index[self.games[index].player] if self._is_arena else 0
+        with self.search_stats.moves.get_lock():
+            self.search_stats.moves[player] += 1
+        with self.search_stats.sims.get_lock():
+            self.search_stats.sims[player] += self.num_sims[index]
+        with self.search_stats.saved_sims.get_lock():
+            self.search_stats.saved_sims[player] += self.sims - self.num_sims[index]
+        with self.search_stats.time.get_lock():
+            self.search_stats.time[player] += self.search_time[index]
+
+    def _add_profile(self, mcts: MCTS):
+        stats = mcts.profile_stats()
+        self.depth_histogram += stats.pop('depth_histogram')
+        self.profile_totals += [stats[key] for key in PROFILE_STATS]
+
+    def reportProfile(self):
+        """Add the profile statistics of all trees of the agent since the last report to the shared search statistics."""
+        profile_totals = self.profile_totals.copy()
+        depth_histogram = self.depth_histogram.copy()
+        for i in range(self.num_games):
+            for mcts in self._trees(i):
+                stats = mcts.profile_stats()
+                depth_histogram += stats.pop('depth_histogram')
+                profile_totals += [stats[key] for key in PROFILE_STATS]
+        with self.search_stats.profile.get_lock():
+            for i, value in enumerate(profile_totals - self._reported_profile):
+                self.search_stats.profile[i] += value
+        with self.search_stats.depth_histogram.get_lock():
+            for i, count in enumerate(depth_histogram - self._reported_depth_histogram):
+                self.search_stats.depth_histogram[i] += int(count)
+        self._reported_profile = profile_totals
+        self._reported_depth_histogram = depth_histogram
+
+    def pruneTrees(self):
+        """Keep the trees of all games within the node budget of the process by
+        pruning every tree that is larger than its share of the budget, and
+        report the tree statistics of the process.
+        """
+        if not self.max_process_nodes and self.search_stats is None:
+            return
+
+        trees = [mcts for i in range(self.num_games) for mcts in self._trees(i)]
+        stats = [mcts.tree_stats() for mcts in trees]
+        num_nodes = sum(s['nodes'] for s in stats)
+
+        if self.max_process_nodes and num_nodes > self.max_process_nodes:
+            max_nodes = self.max_process_nodes // len(trees)
+            for mcts, s in zip(trees, stats):
+                if s['nodes'] > max_nodes:
+                    num_nodes -= mcts.prune(max_nodes)
+
+        if self.search_stats is not None:
+            evictions = self.evictions + sum(mcts.evictions for mcts in trees)
+            evicted_nodes = self.evicted_nodes + sum(mcts.evicted_nodes for mcts in trees)
+            with self.search_stats.peak_nodes.get_lock():
+                self.search_stats.peak_nodes.value = max(self.search_stats.peak_nodes.value, num_nodes)
+            with self.search_stats.evictions.get_lock():
+                self.search_stats.evictions.value += evictions - self._reported_evictions
+            with self.search_stats.evicted_nodes.get_lock():
+                self.search_stats.evicted_nodes.value += evicted_nodes - self._reported_evicted_nodes
+            self._reported_evictions = evictions
+            self._reported_evicted_nodes = evicted_nodes
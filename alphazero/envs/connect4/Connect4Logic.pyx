@@ -47,6 +47,16 @@ cdef class Board():
 
         raise ValueError("Can't play column %s on board %s" % (column, self))
 
+    def remove_stone(self, int column):
+        """Remove the top stone of the column."""
+        cdef Py_ssize_t r
+        for r in range(self.height):
+            if self.pieces[r, column] != 0:
+                self.pieces[r, column] = 0
+                return
+
+        raise ValueError("Can't remove a stone from column %s on board %s" % (column, self))
+
     def get_valid_moves(self):
         """Any zero value in top row is a valid move"""
         cdef Py_ssize_t c
@@ -57,6 +67,18 @@ cdef class Board():
 
         return valid
 
+    def get_legal_actions(self):
+        """The columns of the valid moves"""
+        cdef Py_ssize_t c
+        cdef Py_ssize_t num_actions = 0
+        cdef int[:] actions = np.empty((self.width), dtype=np.intc)
+        for c in range(self.width):
+            if self.pieces[0,c] == 0:
+                actions[num_actions] = c
+                num_actions += 1
+
+        return np.asarray(actions[:num_actions])
+
     def get_win_state(self):
         cdef int player
         cdef int total
@@ -20,16 +20,22 @@ NUM_CHANNELS = 4 if MULTI_PLANE_OBSERVATION else 1
 class Game(GameState):
     def __init__(self):
         super().__init__(self._get_board())
+        # last_action before each action played, so that it can be undone
+        self._last_actions = []
 
     @staticmethod
     def _get_board():
         return Board(DEFAULT_HEIGHT, DEFAULT_WIDTH, DEFAULT_WIN_LENGTH)
 
     def __hash__(self) -> int:
-        return hash(self._board.pieces.tobytes() + bytes([self.turns]) + bytes([self._player]))
+        return hash(np.asarray(self._board.pieces).tobytes() + bytes([self.turns]) + bytes([self._player]))
 
     def __eq__(self, other: 'Game') -> bool:
-        return self._board.pieces == other._board.pieces and self._player == other._player and self.turns == other.turns
+        return (
+            np.array_equal(np.asarray(self._board.pieces), np.asarray(other._board.pieces))
+            and self._player == other._player
+            and self.turns == other.turns
+        )
 
     def clone(self) -> 'Game':
         game = Game()
@@ -62,11 +68,24 @@ class Game(GameState):
     def valid_moves(self):
         return np.asarray(self._board.get_valid_moves())
 
+    def legal_actions(self) -> np.ndarray:
+        return self._board.get_legal_actions()
+
+    @staticmethod
+    def supports_undo() -> bool:
+        return True
+
     def play_action(self, action: int) -> None:
+        self._last_actions.append(self.last_action)
         super().play_action(action)
         self._board.add_stone(action, (1, -1)[self.player])
         self._update_turn()
 
+    def undo_action(self) -> None:
+        self._board.remove_stone(self.last_action)
+        self.last_action = self._last_actions.pop()
+        self._undo_turn()
+
     def win_state(self) -> np.ndarray:
         result = [False] * 3
         game_over, player = self._board.get_win_state()
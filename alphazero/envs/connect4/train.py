@@ -35,6 +35,8 @@ args = get_args(dotdict({
     'pastCompareFreq': 1,
     'cpuct': 4,
     'fpu_reduction': 0.4,
+    'mctsTranspositions': True,
+    'mctsSolver': True,
     'load_model': True,
 }),
     model_gating=True,
@@ -44,19 +44,25 @@ cdef class Game:#(GameState):
     cdef public Board _board
     cdef public int _player
     cdef public int _turns
+    # actions played on the state, so that they can be undone
+    cdef list _actions
     
     def __init__(self, _board=None):
         self._board = _board or self._get_board()
         self._player = 0
         self._turns = 0
+        self._actions = []
 
     @staticmethod
     def _get_board(*args, **kwargs) -> Board:
         return Board(BOARD_SIZE, NUM_IN_ROW, *args, **kwargs)
 
+    def __hash__(self) -> int:
+        return hash((self._board.pieces.tobytes(), self._turns, self._player))
+
     def __eq__(self, other: 'Game') -> bool:
         return (
-            self._board.pieces == other._board.pieces
+            np.array_equal(self._board.pieces, other._board.pieces)
             and self._board.n == other._board.n
             and self._board.n_in_row == other._board.n_in_row
             and self._player == other._player
@@ -116,11 +122,26 @@ cdef class Game:#(GameState):
 
         return np.array(valids, dtype=np.uint8)
 
+    cpdef np.ndarray legal_actions(self):
+        # the empty squares in the order of their actions
+        return np.flatnonzero(self._board.pieces == 0).astype(np.int32)
+
+    @staticmethod
+    def supports_undo():
+        return True
+
     cpdef void play_action(self, int action):
         cdef tuple move = get_move(action, self._board.n)
         self._board.execute_move(move, (1, -1)[self.player])
+        self._actions.append(action)
         self._update_turn()
 
+    cpdef void undo_action(self):
+        cdef tuple move = get_move(self._actions.pop(), self._board.n)
+        self._board[move] = 0
+        self._player = self._next_player(self._player, NUM_PLAYERS - 1)
+        self._turns -= 1
+
     cpdef np.ndarray win_state(self):
         cdef list result = [False] * (NUM_PLAYERS + 1)
         cdef bint game_over
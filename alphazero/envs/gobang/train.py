@@ -13,6 +13,8 @@ args = get_args(
     max_moves=225,
     cpuct=2,
     fpu_reduction=0.1,
+    mctsTranspositions=True,
+    mctsSolver=True,
     symmetricSamples=True,
     numMCTSSims=250,
     numFastSims=50,
@@ -151,6 +151,10 @@ class Game(GameState):
 
         return np.array(valids, dtype=np.intc)
 
+    def legal_actions(self) -> np.ndarray:
+        legal_moves = self._board.all_valid_moves(self._board.to_play())
+        return np.unique(np.array([get_action(self._board, move) for move in legal_moves], dtype=np.int32))
+
     def play_action(self, action: int) -> None:
         move = get_move(self._board, action)
         self._board.move(move, _check_game_end=False, _check_valid=False)
@@ -131,8 +131,11 @@ cdef class Game:#(GameState):
         self._turns = 0
         self.last_action = -1
 
+    def __hash__(self) -> int:
+        return hash((hash(self._board), self._player))
+
     def __eq__(self, other: 'Game') -> bool:
-        return self.__dict__ == other.__dict__
+        return self._board == other._board and self._player == other._player
 
     def __str__(self):
         return str(self._board) + '\n'
@@ -185,6 +188,13 @@ cdef class Game:#(GameState):
 
         return np.array(valids, dtype=np.uint8)
 
+    cpdef np.ndarray legal_actions(self):
+        cdef tuple move
+        return np.unique(np.array([
+            get_action(self._board, move)
+            for move in self._board.legal_moves(pieces=(), piece_type=self._board.to_play())
+        ], dtype=np.int32))
+
     cpdef void play_action(self, int action):
         self.last_action = action
         cdef tuple move = get_move(self._board, action)
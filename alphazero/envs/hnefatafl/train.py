@@ -11,6 +11,7 @@ args = get_args(
     max_moves=DRAW_MOVE_COUNT,
     num_stacked_observations=NUM_STACKED_OBSERVATIONS,
     cpuct=1.25,
+    mctsSolver=True,
     symmetricSamples=False,
     numMCTSSims=100,
     numFastSims=15,
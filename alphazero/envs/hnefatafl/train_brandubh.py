@@ -14,6 +14,8 @@ args = get_args(
     max_moves=100,
     num_stacked_observations=1,
     cpuct=1.25,
+    mctsWideningConstant=2,
+    mctsWideningExponent=0.5,
     symmetricSamples=True,
     numMCTSSims=250,
     numFastSims=50,
@@ -19,11 +19,11 @@ class Game(GameState):
         super().__init__(_board or self._get_board())
 
     def __hash__(self) -> int:
-        return hash(self._board.pieces.tobytes() + bytes([self.turns]) + bytes([self._player]))
+        return hash(np.asarray(self._board.pieces).tobytes() + bytes([self.turns]) + bytes([self._player]))
 
     def __eq__(self, other: 'Game') -> bool:
         return (
-            np.asarray(self._board.pieces) == np.asarray(other._board.pieces)
+            np.array_equal(np.asarray(self._board.pieces), np.asarray(other._board.pieces))
             and self._player == other._player
             and self.turns == other.turns
         )
@@ -74,6 +74,12 @@ class Game(GameState):
 
         return np.array(valids, dtype=np.intc)
 
+    def legal_actions(self) -> np.ndarray:
+        return np.array(
+            sorted(self._board.n * x + y for x, y in self._board.get_legal_moves(self._player_range())),
+            dtype=np.int32
+        )
+
     def play_action(self, action: int) -> None:
         super().play_action(action)
         move = (action // self._board.n, action % self._board.n)
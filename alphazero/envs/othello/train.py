@@ -10,6 +10,7 @@ args = get_args(
     run_name='othello',
     workers=2,
     cpuct=4,
+    mctsTranspositions=True,
     numWarmupIters=1,
     baselineCompareFreq=1,
     pastCompareFreq=1,
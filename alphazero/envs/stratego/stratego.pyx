@@ -209,6 +209,13 @@ cdef class Game:  #(GameState):
 
         return np.array(valids, dtype=np.uint8)
 
+    cpdef np.ndarray legal_actions(self):
+        cdef tuple move
+        return np.unique(np.array([
+            get_action(self._board, move)
+            for move in self._board.legal_moves(pieces=(), piece_type=self._board.to_play())
+        ], dtype=np.int32))
+
     cpdef void play_action(self, int action):
         cdef tuple move = get_move(self._board, action)
         self._board.move(move[0], move[1], check_turn=False, _check_valid=False, _check_win=False)
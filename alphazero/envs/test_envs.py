@@ -0,0 +1,83 @@
+"""
+To run tests:
+pytest alphazero/envs/test_envs.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+import pytest
+
+
+# the modules of the environments that are tested with every game, environments
+# whose engine or dependencies aren't installed are skipped
+ENVS = [
+    'connect4.connect4', 'gobang.gobang', 'othello.othello', 'tictactoe.tictactoe', 'stratego.stratego',
+    'hnefatafl.brandubh', 'hnefatafl.fastafl', 'brandubh.fastafl', 'chess.chess'
+]
+
+
+def get_game_cls(module):
+    return pytest.importorskip(f'alphazero.envs.{module}', exc_type=ImportError).Game
+
+
+def random_actions(game, rng, max_turns):
+    """Yield random actions of a game from its start until it ends or max_turns actions were played."""
+    for _ in range(max_turns):
+        if game.win_state().any():
+            return
+        action = rng.choice(np.flatnonzero(game.valid_moves()))
+        yield action
+        game.play_action(action)
+
+
+def assert_same_state(game, other):
+    assert game.player == other.player
+    assert game.turns == other.turns
+    assert getattr(game, 'last_action', None) == getattr(other, 'last_action', None)
+    assert np.array_equal(game.observation(), other.observation())
+    assert np.array_equal(game.valid_moves(), other.valid_moves())
+    assert np.array_equal(game.win_state(), other.win_state())
+
+
+@pytest.mark.parametrize('module', ['connect4.connect4', 'gobang.gobang'])
+def test_undo_action_restores_state(module):
+    game_cls = get_game_cls(module)
+    assert game_cls.supports_undo()
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        game = game_cls()
+        states = []
+        for action in random_actions(game, rng, 60):
+            states.append(game.clone())
+            # every action can be undone right away
+            game.play_action(action)
+            game.undo_action()
+            assert_same_state(game, states[-1])
+
+        # and all actions can be undone back to the start of the game
+        for state in reversed(states):
+            game.undo_action()
+            assert_same_state(game, state)
+
+
+@pytest.mark.parametrize('module', ENVS)
+def test_legal_actions_match_valid_moves(module):
+    game_cls = get_game_cls(module)
+    rng = np.random.RandomState(0)
+    for _ in range(2):
+        game = game_cls()
+        for _ in random_actions(game, rng, 200):
+            actions = game.legal_actions()
+            assert actions.dtype == np.int32
+            assert np.array_equal(np.sort(actions), np.flatnonzero(game.valid_moves()))
+
+
+@pytest.mark.parametrize('module', ENVS)
+def test_clones_are_equal(module):
+    game_cls = get_game_cls(module)
+    rng = np.random.RandomState(0)
+    game = game_cls()
+    for action in random_actions(game, rng, 20):
+        clone = game.clone()
+        assert clone == game
+        clone.play_action(action)
+        assert not clone == game
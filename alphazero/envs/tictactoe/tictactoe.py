@@ -22,7 +22,7 @@ class Game(GameState):
 
     def __eq__(self, other: 'Game') -> bool:
         return (
-            self._board.pieces == other._board.pieces
+            np.array_equal(self._board.pieces, other._board.pieces)
             and self._board.n == other._board.n
             and self._player == other._player
             and self.turns == other.turns
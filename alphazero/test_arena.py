@@ -0,0 +1,39 @@
+"""
+To run tests:
+pytest alphazero/test_arena.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+from queue import Queue
+
+from alphazero.Arena import Arena
+from alphazero.Coach import DEFAULT_ARGS
+from alphazero.GenericPlayers import BasePlayer
+from alphazero.utils import dotdict, get_game_results
+from alphazero.envs.connect4.connect4 import Game
+
+
+class FirstMovePlayer(BasePlayer):
+    def play(self, state):
+        return int(np.flatnonzero(state.valid_moves())[0])
+
+
+def test_results_pass_on_states():
+    game = Game()
+    game.play_action(3)
+    results = Queue()
+    results.put(([0], 1, 0, game))
+    results.put(([1], 2, 0))
+    states = []
+    wins, draws, avg_game_length = get_game_results(results, Game, states=states)
+    assert states == [game]
+    assert (wins, draws, avg_game_length) == ([1, 1], 0, 1.5)
+
+
+def test_arena_keeps_states():
+    for result_states in (False, True):
+        arena = Arena([FirstMovePlayer(), FirstMovePlayer()], Game, use_batched_mcts=False,
+                      args=dotdict({**DEFAULT_ARGS, 'result_states': result_states}))
+        arena.play_games(2)
+        assert len(arena.game_states) == (2 if result_states else 0)
+        assert all(state.win_state().any() for state in arena.game_states)
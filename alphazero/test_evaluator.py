@@ -0,0 +1,41 @@
+"""
+To run tests:
+pytest alphazero/test_evaluator.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+import threading
+import pytest
+
+from alphazero.Coach import DEFAULT_ARGS
+from alphazero.Evaluator import MCTSEvaluator
+from alphazero.utils import dotdict
+from alphazero.envs.connect4.connect4 import Game
+
+
+def failing_model(max_calls):
+    """A uniform model that raises a RuntimeError once it was called max_calls times."""
+    calls = 0
+    lock = threading.Lock()
+    p = np.full(Game.action_size(), 1 / Game.action_size(), dtype=np.float32)
+    v = np.full(Game.num_players() + 1, 1 / (Game.num_players() + 1), dtype=np.float32)
+
+    def model(state):
+        nonlocal calls
+        with lock:
+            calls += 1
+            if calls > max_calls:
+                raise RuntimeError('evaluation failed')
+        return p, v
+
+    return model
+
+
+def test_parallel_search_raises_errors():
+    args = dotdict({**DEFAULT_ARGS, '_num_players': Game.num_players() + Game.has_draw()})
+    evaluator = MCTSEvaluator(args, num_sims=1000, leaves_per_batch=4, num_threads=4)
+    with pytest.raises(RuntimeError, match='evaluation failed'):
+        evaluator._search(Game(), failing_model(100), 1000)
+    # the leaves of the failed batches don't hold on to their virtual loss
+    assert not np.any(evaluator._mcts._virtual_loss[:evaluator._mcts._num_edges])
+    assert 0 < evaluator._mcts._n[0] <= 100
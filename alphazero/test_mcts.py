@@ -0,0 +1,293 @@
+"""
+To run tests:
+pytest alphazero/test_mcts.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+import pytest
+
+from alphazero.MCTS import MCTS, BatchedMCTS
+from alphazero.utils import dotdict
+from alphazero.envs.connect4.connect4 import Game
+
+
+def make_args(**kwargs):
+    args = dotdict(root_noise_frac=0.25, root_policy_temp=1.1, min_discount=1, fpu_reduction=0.2, cpuct=1.25,
+                   _num_players=Game.num_players() + Game.has_draw())
+    args.update(kwargs)
+    return args
+
+
+def play(actions):
+    game = Game()
+    for action in actions:
+        game.play_action(action)
+    return game
+
+
+def forced_draw():
+    """A board with two empty cells left, the game is a draw whichever way they are filled."""
+    game = Game()
+    game._board.pieces = np.array([
+        [1, -1, 1, 1, 0, 0, 1],
+        [1, 1, 1, -1, -1, 1, -1],
+        [-1, -1, -1, 1, -1, -1, 1],
+        [-1, 1, -1, 1, 1, 1, -1],
+        [1, 1, -1, 1, 1, -1, -1],
+        [-1, -1, 1, -1, 1, -1, -1]
+    ], dtype=np.intc)
+    game._turns = 40
+    return game
+
+
+def uniform_results(batch_size):
+    """Evaluations of a network that knows nothing, for a batch of batch_size rows."""
+    values = np.full((batch_size, Game.num_players() + 1), 1 / (Game.num_players() + 1), dtype=np.float32)
+    pis = np.full((batch_size, Game.action_size()), 1 / Game.action_size(), dtype=np.float32)
+    return values, pis
+
+
+def test_batched_sims_use_budget():
+    sims, leaves_per_tree, num_trees = 100, 8, 4
+    mcts = BatchedMCTS(make_args(), num_trees, leaves_per_tree)
+    games = [Game() for _ in range(num_trees)]
+    batch = np.zeros((num_trees * leaves_per_tree, *Game.observation_size()), dtype=np.float32)
+    values, pis = uniform_results(len(batch))
+
+    mcts.start_search(sims)
+    # collisions leave some batches short, the search goes on until the budget is used
+    while mcts.update_searching():
+        mcts.find_leaves(games, batch)
+        mcts.process_results(games, values, pis, False, False)
+
+    assert (mcts.num_sims == sims).all()
+    for i in range(num_trees):
+        # the first simulation of a new tree evaluates the root itself
+        assert np.sum(mcts[i].counts(games[i])) == mcts.num_sims[i] - 1
+
+
+def solve(game, sims=2000, **kwargs):
+    mcts = MCTS(make_args(mctsSolver=True, **kwargs))
+    mcts.raw_search(game, sims, False, False)
+    return mcts
+
+
+def test_solver_proves_win():
+    # the first player completes the bottom row with column 3
+    mcts = solve(play([0, 6, 1, 6, 2, 5]))
+    assert mcts.root_result().tolist() == [1, 0, 0]
+    assert mcts.value() == 1
+
+
+def test_solver_proves_loss():
+    # the second player threatens to complete the bottom row on both sides
+    mcts = solve(play([6, 2, 2, 3, 3, 4]))
+    assert mcts.root_result().tolist() == [0, 1, 0]
+    assert mcts.value() == 0
+
+
+def test_solver_proves_draw():
+    # the win state includes the draw even if _num_players doesn't count it
+    for num_players in (Game.num_players(), Game.num_players() + 1):
+        mcts = solve(forced_draw(), _num_players=num_players)
+        assert mcts.root_result().tolist() == [0, 0, 1]
+        assert mcts.value() == 0.5
+        assert mcts.node_stats()['proven'].tolist() == [0, 0, 1]
+
+
+def test_unsolved_root_has_no_result():
+    mcts = solve(Game(), sims=50)
+    assert mcts.root_result() is None
+
+
+def test_snapshot_keeps_solved_results():
+    for game in (play([0, 6, 1, 6, 2, 5]), play([6, 2, 2, 3, 3, 4]), forced_draw()):
+        mcts = solve(game, _num_players=Game.num_players())
+        restored = MCTS(make_args(mctsSolver=True, _num_players=Game.num_players()))
+        restored.from_bytes(mcts.to_bytes())
+        assert restored.root_result().tolist() == mcts.root_result().tolist()
+        assert restored.value() == mcts.value()
+        assert np.asarray(restored.counts(game)).tolist() == np.asarray(mcts.counts(game)).tolist()
+
+
+def test_snapshot_needs_same_players():
+    mcts = solve(Game(), sims=50, _num_players=Game.num_players())
+    # snapshots that leave out nodes are restored in a tree of the same instance
+    restored = MCTS(make_args(_num_players=Game.num_players()))
+    restored.from_bytes(mcts.to_bytes(max_depth=1))
+    assert restored._size < mcts._size
+
+    with pytest.raises(ValueError):
+        MCTS(make_args(_num_players=Game.num_players() + 1)).from_bytes(mcts.to_bytes())
+
+
+def random_network(observations):
+    """A network that makes random guesses for a batch of observations, so that the trees of the searches differ."""
+    values = np.random.dirichlet(np.ones(Game.num_players() + 1), len(observations)).astype(np.float32)
+    pis = np.random.dirichlet(np.ones(Game.action_size()), len(observations)).astype(np.float32)
+    return pis, values
+
+
+def test_solved_root_keeps_proving_child():
+    # transpositions and eviction change the nodes of the tree after the root is updated, the
+    # result of the root must still be carried by one of its visited children, the seeds
+    # lead to games where a solved root lost the child that proved it
+    for extra, seed in (({'mctsMaxNodes': 40}, 85), ({'mctsWideningConstant': 2}, 35)):
+        np.random.seed(seed)
+        mcts = MCTS(make_args(mctsSolver=True, mctsTranspositions=True, **extra))
+        game = Game()
+        while not game.win_state().any():
+            mcts.batch_search(game, random_network, 40, 4, False, False)
+            counts = np.asarray(mcts.counts(game))
+            assert np.sum(counts) > 0
+            assert np.all(game.valid_moves()[counts > 0])
+            assert np.isclose(np.sum(mcts.probs(game)), 1)
+            action = mcts.best_action(game)
+            mcts.update_root(game, action)
+            game.play_action(action)
+
+
+def test_pruned_tree_keeps_proven_children():
+    # every move of the root loses, the children of the moves hold the wins of the opponent
+    game = play([6, 2, 2, 3, 3, 4])
+    mcts = solve(game)
+    mcts.prune(10)
+    action = mcts.best_action(game)
+    mcts.update_root(game, action)
+    game.play_action(action)
+    assert mcts.root_result().tolist() == [0, 1, 0]
+    counts = np.asarray(mcts.counts(game))
+    assert np.sum(counts) > 0
+    assert game.valid_moves()[np.argmax(counts)]
+
+
+class CollidingGame(Game):
+    """Connect4 where all positions with the same number of turns have the same hash."""
+    def __hash__(self):
+        return self.turns
+
+    def clone(self):
+        game = CollidingGame()
+        game._board.pieces = np.copy(np.asarray(self._board.pieces))
+        game._player = self._player
+        game._turns = self.turns
+        game.last_action = self.last_action
+        return game
+
+
+def find_node(mcts, actions):
+    """Get the node reached by playing actions from the root of the tree."""
+    node = 0
+    for action in actions:
+        first = mcts._first_child[node]
+        edges = np.arange(first, first + mcts._num_children[node])
+        node = mcts._child[edges[mcts._a[edges] == action][0]]
+    return node
+
+
+def node_positions(mcts, game):
+    """Get the positions of the nodes of the tree searched from game."""
+    positions = {0: game}
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        first = mcts._first_child[node]
+        for edge in range(first, first + mcts._num_children[node]) if first != -1 else []:
+            child = mcts._child[edge]
+            if child != -1 and child not in positions:
+                positions[child] = positions[node].clone()
+                positions[child].play_action(mcts._a[edge])
+                stack.append(child)
+    return positions
+
+
+def assert_no_cycles(mcts):
+    # depth first search through the positions of the tree, a position must not be reached from itself
+    state = {}
+    stack = [(mcts._link[0], False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            state[node] = 'done'
+            continue
+        if state.get(node) == 'done':
+            continue
+        state[node] = 'open'
+        stack.append((node, True))
+        first = mcts._first_child[node]
+        for child in mcts._child[first:first + mcts._num_children[node]] if first != -1 else []:
+            if child != -1:
+                assert state.get(mcts._link[child]) != 'open'
+                stack.append((mcts._link[child], False))
+
+
+def test_transposed_nodes_share_edges():
+    np.random.seed(0)
+    mcts = MCTS(make_args(mctsTranspositions=True))
+    mcts.raw_search(Game(), 3000, False, False)
+    assert mcts.tt_hits > 0
+    # the same position reached through two move orders
+    node, other = find_node(mcts, [3, 2, 4]), find_node(mcts, [4, 2, 3])
+    assert mcts._link[node] == mcts._link[other]
+    assert mcts._first_child[node] == mcts._first_child[other]
+    assert mcts._num_children[node] == mcts._num_children[other]
+    for node in range(mcts._size):
+        link = mcts._link[node]
+        # links always lead to the node holding the statistics of the position
+        assert mcts._link[link] == link
+        if link != node:
+            assert mcts._first_child[node] == mcts._first_child[link]
+    assert_no_cycles(mcts)
+
+
+def test_transpositions_compare_positions():
+    np.random.seed(0)
+    game = CollidingGame()
+    mcts = MCTS(make_args(mctsTranspositions=True))
+    mcts.raw_search(game, 1000, False, False)
+    positions = node_positions(mcts, game)
+    linked = [node for node in positions if mcts._link[node] != node]
+    assert linked
+    for node in linked:
+        assert positions[node] == positions[mcts._link[node]]
+
+
+def child_visits(mcts, node):
+    """Get the visits of the children of a node by their action."""
+    first = mcts._first_child[node]
+    return {mcts._a[c]: mcts._n[c] for c in range(first, first + mcts._num_children[node])}
+
+
+def test_update_root_evicts_to_budget():
+    max_nodes = 50
+    mcts = MCTS(make_args(mctsMaxNodes=max_nodes))
+    game = Game()
+    mcts.raw_search(game, 1000, False, False)
+    action = mcts.best_action(game)
+    first = mcts._first_child[0]
+    edge = first + list(mcts._a[first:first + mcts._num_children[0]]).index(action)
+    visits = child_visits(mcts, mcts._child[edge])
+    assert mcts._size > max_nodes
+
+    mcts.update_root(game, action)
+    game.play_action(action)
+    assert mcts._size <= max_nodes
+    assert child_visits(mcts, 0) == visits
+    assert np.sum(mcts.counts(game)) == np.sum(list(visits.values()))
+
+
+def test_widening_visits_best_children():
+    np.random.seed(0)
+    constant, exponent = 1, 0.5
+    mcts = MCTS(make_args(mctsWideningConstant=constant, mctsWideningExponent=exponent))
+    game = Game()
+    for sims in (5, 10, 20):
+        mcts.search(game, lambda board: [x[0] for x in random_network([board])], sims, False, False)
+        first = mcts._first_child[0]
+        n = np.asarray(mcts._n[first:first + mcts._num_children[0]])
+        p = np.asarray(mcts._p[first:first + mcts._num_children[0]])
+        # only the children with the highest priors are searched
+        widened = int(np.ceil(constant * mcts._n[0] ** exponent))
+        assert np.count_nonzero(n) <= widened < len(n)
+        assert p[n > 0].min() >= p[n == 0].max()
+    assert np.count_nonzero(n) > 1
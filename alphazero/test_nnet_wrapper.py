@@ -0,0 +1,79 @@
+"""
+To run tests:
+pytest alphazero/test_nnet_wrapper.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+import sys
+import torch
+
+from alphazero.Coach import DEFAULT_ARGS
+from alphazero.NNetWrapper import NNetWrapper, EvaluationCache
+from alphazero.utils import dotdict
+from alphazero.envs.connect4.connect4 import Game
+
+
+def make_nnet(**kwargs):
+    return NNetWrapper(Game, dotdict({**DEFAULT_ARGS, 'cuda': False, 'nnet_cache_mb': 1, **kwargs}))
+
+
+def observations(num_games):
+    """Observations of games that start with different moves."""
+    boards = []
+    for action in range(num_games):
+        game = Game()
+        game.play_action(action)
+        boards.append(game.observation())
+    return np.array(boards, dtype=np.float32)
+
+
+def test_cache_hits():
+    nnet = make_nnet()
+    boards = observations(3)
+    pi, v = nnet.predict(boards[:1])
+    cached_pi, cached_v = nnet.predict(boards[:1].copy())
+    assert (nnet.cache.hits, nnet.cache.misses) == (1, 1)
+    assert np.array_equal(pi, cached_pi) and np.array_equal(v, cached_v)
+
+    # batches reuse the evaluations of the boards that were seen before
+    batch_pi, batch_v = nnet.predict_batch(boards)
+    assert (nnet.cache.hits, nnet.cache.misses) == (2, 3)
+    cached_pi, cached_v = nnet.predict_batch(boards)
+    assert (nnet.cache.hits, nnet.cache.misses) == (5, 3)
+    assert np.array_equal(batch_pi, cached_pi) and np.array_equal(batch_v, cached_v)
+
+
+def test_cache_evicts_least_recently_used():
+    pi, v = np.zeros(Game.action_size(), dtype=np.float32), np.zeros(3, dtype=np.float32)
+    keys = [(0, board.tobytes()) for board in observations(3)]
+    entry_size = pi.nbytes + v.nbytes + sys.getsizeof(keys[0][1]) + EvaluationCache._ENTRY_OVERHEAD
+    cache = EvaluationCache(2 * entry_size)
+    cache.put(keys[0], pi, v)
+    cache.put(keys[1], pi, v)
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], pi, v)
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+
+
+def test_cache_cleared_on_new_weights(tmp_path):
+    nnet = make_nnet()
+    boards = observations(2)
+    nnet.predict_batch(boards)
+    version = nnet.model_version
+
+    targets = (torch.from_numpy(boards), torch.full((2, Game.action_size()), 1 / Game.action_size()),
+               torch.full((2, 3), 1 / 3))
+    nnet.train([targets], 1)
+    assert len(nnet.cache) == 0
+    assert nnet.model_version > version
+
+    nnet.save_checkpoint(str(tmp_path))
+    nnet.predict_batch(boards)
+    version = nnet.model_version
+    nnet.load_checkpoint(str(tmp_path), use_saved_args=False)
+    assert len(nnet.cache) == 0
+    assert nnet.model_version > version
+    nnet.predict_batch(boards)
+    assert nnet.cache.hits == 0
@@ -0,0 +1,67 @@
+"""
+To run tests:
+pytest alphazero/test_sample_buffer.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+from torch import multiprocessing as mp
+import collections
+import shutil
+import pytest
+import torch
+
+from alphazero.SampleBuffer import SampleBuffer
+from alphazero.envs.connect4.connect4 import Game
+
+
+def make_samples(start, count):
+    """Samples whose entries are all set to their number, counted from start."""
+    numbers = np.arange(start, start + count, dtype=np.float32)
+    return tuple(
+        np.broadcast_to(numbers.reshape(-1, *[1] * len(shape)), (count, *shape)).copy()
+        for shape in (Game.observation_size(), (Game.action_size(),), (Game.num_players() + 1,))
+    )
+
+
+def read_numbers(chunks):
+    """The numbers of the samples read from the buffer, checking that their entries match."""
+    numbers = []
+    for chunk in chunks:
+        data, policy, value = chunk
+        assert torch.equal(data[:, 0, 0, 0], policy[:, 0]) and torch.equal(policy[:, 0], value[:, 0])
+        for tensor in chunk:
+            entries = tensor.flatten(1)
+            assert (entries == entries[:, :1]).all()
+        numbers.extend(data[:, 0, 0, 0].int().tolist())
+    return numbers
+
+
+def test_write_read_wraps_around():
+    buffer = SampleBuffer(Game, 2, 8)
+    assert buffer.write(0, *make_samples(0, 5))
+    assert buffer.write(1, *make_samples(100, 3))
+    assert read_numbers(buffer.read()) == [0, 1, 2, 3, 4, 100, 101, 102]
+    assert buffer.read() == []
+
+    # the ring of writer 0 wraps around after 3 more samples
+    assert buffer.write(0, *make_samples(5, 6))
+    chunks = buffer.read()
+    assert [len(chunk[0]) for chunk in chunks] == [3, 3]
+    assert read_numbers(chunks) == [5, 6, 7, 8, 9, 10]
+
+
+def test_write_to_full_buffer_stops():
+    buffer = SampleBuffer(Game, 1, 4)
+    stop_event = mp.Event()
+    stop_event.set()
+    # the samples that don't fit are dropped once the writer is stopped
+    assert not buffer.write(0, *make_samples(0, 6), stop_event)
+    assert read_numbers(buffer.read()) == [0, 1, 2, 3]
+
+
+def test_too_large_buffer_fails(monkeypatch, tmp_path):
+    usage = collections.namedtuple('usage', 'total used free')
+    monkeypatch.setattr('alphazero.SampleBuffer.SHARED_MEMORY_DIR', str(tmp_path))
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: usage(2 ** 20, 0, 2 ** 20))
+    with pytest.raises(MemoryError):
+        SampleBuffer(Game, 4, 8192)
@@ -0,0 +1,43 @@
+"""
+To run tests:
+pytest alphazero/test_self_play_agent.py
+"""
+import pyximport, numpy as np
+pyximport.install(setup_args={'include_dirs': np.get_include()})
+from torch import multiprocessing as mp
+import pytest
+import torch
+
+from alphazero.SelfPlayAgent import SelfPlayAgent
+from alphazero.utils import dotdict, default_temp_scaling
+from alphazero.envs.connect4.connect4 import Game
+
+
+def make_agent(split_rows, leaves_per_tree):
+    """Create a self play agent whose games are split into groups with the given number of batch rows."""
+    args = dotdict(root_noise_frac=0.25, root_policy_temp=1.1, min_discount=1, fpu_reduction=0.2, cpuct=1.25,
+                   _num_players=Game.num_players() + Game.has_draw(), gamesPerIteration=1, probFastSim=0,
+                   numFastSims=1, numMCTSSims=1, numWarmupSims=1, startTemp=1, temp_scaling_fn=default_temp_scaling,
+                   add_root_noise=False, add_root_temp=False, mctsResetThreshold=None, symmetricSamples=False,
+                   mctsLeavesPerTree=leaves_per_tree)
+    tensors = [
+        [torch.zeros([rows, *shape]) for rows in split_rows]
+        for shape in (Game.observation_size(), (Game.action_size(),), (Game.num_players() + 1,))
+    ]
+    return SelfPlayAgent(0, Game, mp.Queue(), [mp.Event() for _ in split_rows], *tensors, None, mp.Queue(),
+                         mp.Value('i', 0), mp.Value('i', 0), mp.Event(), mp.Event(), args)
+
+
+def test_split_slots_cover_all_games():
+    agent = make_agent([8, 8], 4)
+    assert agent.num_games == 4
+    assert agent.split_slots == [(0, 2), (2, 4)]
+
+    agent = make_agent([9, 7], 1)
+    assert agent.num_games == 16
+    assert agent.split_slots == [(0, 9), (9, 16)]
+
+
+def test_split_rows_must_hold_whole_games():
+    with pytest.raises(ValueError):
+        make_agent([10, 10], 4)
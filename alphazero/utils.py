@@ -31,7 +31,12 @@ def const_temp_scaling(temp, *args, **kwargs) -> float:
     return temp
 
 
-def get_game_results(result_queue, game_cls, _get_index=None):
+def get_game_results(result_queue, game_cls, _get_index=None, states=None):
+    """Count the results of the finished games on the result queue. A result is a tuple of the
+    winners (the indices of the set entries of the win state), the number of turns and the id of
+    the agent, followed by the final state of the game if the agents put it on the queue,
+    in which case the states are appended to the given states list.
+    """
     player_to_index = {p: i for i, p in enumerate(range(game_cls.num_players()))}
 
     num_games = result_queue.qsize()
@@ -40,20 +45,65 @@ def get_game_results(result_queue, game_cls, _get_index=None):
     game_len_sum = 0
 
     for _ in range(num_games):
-        state, winstate, agent_id = result_queue.get()
-        game_len_sum += state.turns
-
-        for player, is_win in enumerate(winstate):
-            if is_win:
-                if player == len(wins):
-                    draws += 1
-                else:
-                    index = _get_index(player, agent_id) if _get_index else player_to_index[player]
-                    wins[index] += 1
+        winners, turns, agent_id, *state = result_queue.get()
+        game_len_sum += turns
+        if state and states is not None:
+            states.append(state[0])
+
+        for player in winners:
+            if player == len(wins):
+                draws += 1
+            else:
+                index = _get_index(player, agent_id) if _get_index else player_to_index[player]
+                wins[index] += 1
 
     return wins, draws, game_len_sum / num_games if num_games else 0
 
 
+# Number of bins of the resignation values of the played out games in the range [0, 1],
+# values of 1 and games that would never be resigned are counted in an extra last bin.
+RESIGN_CALIBRATION_BINS = 100
+
+
+def new_search_stats(num_players: int = 1) -> dotdict:
+    """Create the search statistics shared between the self play agents and the main process.
+    The moves, simulations, saved simulations and search time in seconds are counted for each player index.
+    The profile statistics of the trees are summed up in the order of MCTS.PROFILE_STATS.
+    The resignation statistics count the resigned games, the games played out with resignation
+    disabled, the played out games that would have been resigned and the moves played in them
+    after that point, and the histogram of the lowest resignation value of a player who didn't
+    lose each played out game.
+    """
+    from torch import multiprocessing as mp
+    from alphazero.MCTS import PROFILE_STATS, PROFILE_MAX_DEPTH
+    return dotdict({
+        'moves': mp.Array('l', num_players),
+        'sims': mp.Array('l', num_players),
+        'saved_sims': mp.Array('l', num_players),
+        'time': mp.Array('d', num_players),
+        'peak_nodes': mp.Value('l', 0),
+        'evictions': mp.Value('l', 0),
+        'evicted_nodes': mp.Value('l', 0),
+        'profile': mp.Array('d', len(PROFILE_STATS)),
+        'depth_histogram': mp.Array('l', PROFILE_MAX_DEPTH),
+        'resigned': mp.Value('l', 0),
+        'resign_playouts': mp.Value('l', 0),
+        'resign_would_resign': mp.Value('l', 0),
+        'resign_playout_moves': mp.Value('l', 0),
+        'resign_calibration': mp.Array('l', RESIGN_CALIBRATION_BINS + 1)
+    })
+
+
+def reset_search_stats(stats: dotdict):
+    """Set the search statistics of new_search_stats back to zero in place, for agents that keep running."""
+    for value in stats.values():
+        with value.get_lock():
+            if hasattr(value, '__len__'):
+                value[:] = [0] * len(value)
+            else:
+                value.value = 0
+
+
 def plot_mcts_tree(mcts, max_depth=2):
     import networkx as nx
     import matplotlib.pyplot as plt
@@ -67,15 +117,16 @@ def plot_mcts_tree(mcts, max_depth=2):
         global node_idx
         cur_idx = node_idx
 
-        G.add_node(cur_idx, a=cur_node.a, q=round(cur_node.q, 2), n=cur_node.n, v=round(cur_node.v, 2))
-        if _past_node:
+        stats = mcts.node_stats(cur_node)
+        G.add_node(cur_idx, a=stats['a'], q=round(stats['q'], 2), n=stats['n'], v=round(stats['v'], 2))
+        if _past_node is not None:
             G.add_edge(cur_idx, _past_i)
         node_idx += 1
 
-        for node in cur_node._children:
+        for node in mcts.children(cur_node):
             find_nodes(node, cur_node, cur_idx, _depth+1)
 
-    find_nodes(mcts._root)
+    find_nodes(0)
     labels = {node: '\n'.join(['{}: {}'.format(k, v) for k, v in G.nodes[node].items()]) for node in G.nodes}
     #pos = nx.spring_layout(G, k=0.15, iterations=50)
     pos = nx.nx_agraph.graphviz_layout(G, prog='dot', args='-Gnodesep=1.0 -Goverlap=false')